@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Writes a synthetic Ansible tree to lint in benchmarks.
+
+The same (scale) and (seed) always give the same files: roles with tasks,
+handlers, defaults and templates, a large group_vars file, deeply nested and
+long templates, and scalars that repeat across the files like "{{ item }}".
+The files are valid, so the linter goes through all of its checks on them.
+
+    benchmarks/corpus.py DIRECTORY [--scale N] [--seed N]
+"""
+
+import argparse
+import random
+import sys
+from pathlib import Path
+
+FILTERS = ["default('')", "lower", "upper", "join(',')", "length", "int", "to_json"]
+TESTS = ["defined", "undefined", "none", "string", "number"]
+# the same strings, over and over, as in real playbooks; the scalar memo case:
+REPEATED = [
+    "{{ item }}",
+    "{{ item.name }}",
+    "{{ inventory_hostname }}",
+    "{{ ansible_facts['os_family'] }}",
+    "present",
+    "yes",
+]
+
+
+def expression(rng: random.Random, depth: int = 0) -> str:
+    """A Jinja2 expression with filters and tests, without the {{ }}."""
+    name = f"var_{rng.randrange(50)}"
+    if rng.random() < 0.5:
+        name += f".attr_{rng.randrange(5)}"
+    for _ in range(rng.randrange(3)):
+        name += " | " + rng.choice(FILTERS)
+    if depth < 2 and rng.random() < 0.3:
+        name = f"({name}) if ({expression(rng, depth + 1)}) is defined else 'x'"
+    return name
+
+
+def condition(rng: random.Random) -> str:
+    return f"var_{rng.randrange(50)} is {rng.choice(TESTS)}"
+
+
+def template(rng: random.Random, lines: int, depth: int) -> str:
+    """A template of about (lines) lines, with blocks nested (depth) deep."""
+    out = []
+    for i in range(lines):
+        out.append(f"line {i} {{{{ {expression(rng)} }}}} text")
+        if i % max(1, lines // 10) == 0:
+            for level in range(depth):
+                pad = "  " * level
+                if level % 2:
+                    out.append(f"{pad}{{% for x{level} in list_{level} %}}")
+                else:
+                    out.append(f"{pad}{{% if {condition(rng)} %}}")
+            out.append("  " * depth + f"{{{{ {expression(rng)} }}}}")
+            for level in reversed(range(depth)):
+                end = "{% endfor %}" if level % 2 else "{% endif %}"
+                out.append("  " * level + end)
+    return "\n".join(out) + "\n"
+
+
+def task(rng: random.Random, i: int) -> str:
+    lines = [f"- name: Task {i} {{{{ {expression(rng)} }}}}"]
+    kind = rng.randrange(4)
+    if kind == 0:
+        lines += [
+            "  ansible.builtin.template:",
+            f"    src: t{rng.randrange(3)}.j2",
+            f'    dest: "/etc/app/{{{{ {expression(rng)} }}}}"',
+        ]
+    elif kind == 1:
+        lines += [
+            "  ansible.builtin.debug:",
+            f'    msg: "{rng.choice(REPEATED)}"',
+            f'  loop: "{{{{ list_{rng.randrange(9)} }}}}"',
+        ]
+    elif kind == 2:
+        lines += [
+            "  ansible.builtin.command: /bin/true",
+            f"  register: result_{i}",
+            "  changed_when: false",
+        ]
+    else:
+        lines += [
+            "  ansible.builtin.package:",
+            f'    name: "{rng.choice(REPEATED)}"',
+            "    state: present",
+        ]
+    lines.append(f"  when: {condition(rng)}")
+    if rng.random() < 0.3:
+        lines.append(f"  tags: [tag_{rng.randrange(8)}, always]")
+    return "\n".join(lines) + "\n"
+
+
+def vars_file(rng: random.Random, entries: int) -> str:
+    lines = ["---", "common: &common", "  owner: root", "  mode: '0644'"]
+    for i in range(entries):
+        lines.append(f"key_{i}:")
+        lines.append("  <<: *common")
+        lines.append(f'  value: "{rng.choice(REPEATED)}"')
+        lines.append(f'  computed: "{{{{ {expression(rng)} }}}}"')
+        lines.append(f"  plain: some text {i}")
+    return "\n".join(lines) + "\n"
+
+
+def write_corpus(directory: Path, scale: int = 1, seed: int = 0) -> list[Path]:
+    """Writes the corpus for (scale) and (seed) under (directory); returns the
+    files written."""
+    rng = random.Random(seed)
+    files = {}
+    for r in range(4 * scale):
+        role = f"roles/role_{r}"
+        files[f"{role}/tasks/main.yml"] = "---\n" + "".join(
+            task(rng, i) for i in range(25)
+        )
+        files[f"{role}/handlers/main.yml"] = "---\n" + "".join(
+            task(rng, i).replace("- name: Task", "- name: Handler") for i in range(5)
+        )
+        files[f"{role}/defaults/main.yml"] = vars_file(rng, 20)
+        for t in range(3):
+            files[f"{role}/templates/t{t}.j2"] = template(rng, 40, 3)
+    files["group_vars/all/main.yml"] = vars_file(rng, 2000 * scale)
+    files["templates/deep.j2"] = template(rng, 200, 12)
+    files["templates/long.j2"] = template(rng, 5000 * scale, 2)
+    written = []
+    for name, contents in files.items():
+        path = directory / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(contents)
+        written.append(path)
+    return written
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("DIRECTORY", type=Path)
+    parser.add_argument("--scale", type=int, default=1, help="size multiplier")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    files = write_corpus(args.DIRECTORY, args.scale, args.seed)
+    size = sum(path.stat().st_size for path in files)
+    print(f"{len(files)} files, {size >> 10} KiB in {args.DIRECTORY}")
+    return 0
+
+
+if "__main__" == __name__:
+    sys.exit(main())
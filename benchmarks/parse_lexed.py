@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""Times parse_lexed() on synthetic templates of growing size.
+
+The time per token should stay flat as the templates grow; if it grows with the
+size of the template, one of the heuristics has gone quadratic.
+
+    benchmarks/parse_lexed.py [TOKENS ...]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import jinjalint  # noqa: E402
+
+# a bit of everything parse_lexed() looks at: blocks, filters, tests, braces
+UNIT = (
+    "{% if x is defined %}{{ x | default('a') | ansible.builtin.quote }}"
+    " { {% for i in y %}{{ i.a is not ansible.utils.in_network }}{% endfor %}"
+    "{% elif ansible_distribution == 'Debian' %}{{ z }}{% endif %}\n"
+)
+
+
+def template(tokens: int) -> str:
+    """A template of roughly (tokens) tokens, all inside one {% if %}."""
+    unit_tokens = len(list(jinjalint.JINJA2_SANDBOX_ENVIRON.lex(UNIT)))
+    return "{% if top %}\n" + UNIT * max(1, tokens // unit_tokens) + "{% endif %}"
+
+
+def main(sizes) -> int:
+    session = jinjalint.LintSession()
+    print(f"{'tokens':>8} {'seconds':>9} {'us/token':>9}")
+    for size in sizes:
+        lexed = jinjalint.analyze_scalar(session, template(size), None, False).lexed
+        start = time.perf_counter()
+        jinjalint.parse_lexed(session, lexed)
+        elapsed = time.perf_counter() - start
+        print(f"{len(lexed):>8} {elapsed:>9.3f} {elapsed / len(lexed) * 1e6:>9.2f}")
+    return 0
+
+
+if "__main__" == __name__:
+    sys.exit(main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000]))
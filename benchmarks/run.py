@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""Runs the benchmarks on a synthetic corpus and compares the results to a
+previous run.
+
+The corpus comes from corpus.py, written to a temporary directory unless one is
+given. Each benchmark runs (repeat) times and keeps the best result, since the
+slower runs mostly measure the rest of the machine. With --compare, a metric
+that got worse by more than (threshold) counts as a regression and the exit
+status is 1.
+
+    benchmarks/run.py [--scale N] [--seed N] [--repeat N] [--corpus DIRECTORY]
+                      [--output FILE] [--compare FILE] [--threshold FRACTION]
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+import jinjalint  # noqa: E402
+import corpus  # noqa: E402
+
+SCRIPT = os.path.join(ROOT, "jinjalint.py")
+
+
+def clear_memo() -> None:
+    """Empties the scalar memo, so each run analyzes every scalar again."""
+    jinjalint.SCALAR_MEMO.entries.clear()
+    jinjalint.SCALAR_MEMO.nbytes = 0
+
+
+def elapsed(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def import_seconds(files) -> float:
+    """A new interpreter importing jinjalint."""
+    return elapsed(subprocess.run, [sys.executable, "-c", "import jinjalint"])
+
+
+def startup_seconds(files) -> float:
+    """The command line on a one-line file: imports, catalog, argument parsing."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory, "tiny.yml")
+        path.write_text("- debug: msg={{ x }}\n")
+        return elapsed(subprocess.run, [sys.executable, SCRIPT, "-q", str(path)])
+
+
+def yaml_events_per_second(files) -> float:
+    contents = [(path, path.read_text()) for path in files if jinjalint.is_yaml(path)]
+    events = 0
+    start = time.perf_counter()
+    for path, text in contents:
+        for _ in jinjalint.ruamel_generator(path, text):
+            events += 1
+    return events / (time.perf_counter() - start)
+
+
+def check_str_per_second(files) -> float:
+    """check_str() on every non-plain scalar of the YAML files, memo cleared."""
+    scalars = []
+    for path in files:
+        if jinjalint.is_yaml(path):
+            for event in jinjalint.ruamel_generator(path):
+                if isinstance(event, jinjalint.ruamel.yaml.events.ScalarEvent):
+                    scalars.append((event, [(0, 0, f"{path}:"), (0, 0, "value")]))
+    session = jinjalint.LintSession()
+    clear_memo()
+    start = time.perf_counter()
+    for event, pos_stack in scalars:
+        jinjalint.check_str(session, event, pos_stack)
+    return len(scalars) / (time.perf_counter() - start)
+
+
+def lexed_templates(files) -> list:
+    """analyze_scalar() of each template, with the tokens."""
+    session = jinjalint.LintSession()
+    analyses = []
+    for path in files:
+        if path.suffix == ".j2":
+            analysis = jinjalint.analyze_scalar(
+                session, path.read_text(), None, False, lex=True
+            )
+            analyses.append(analysis)
+    return analyses
+
+
+def parse_lexed_us_per_token(files) -> float:
+    session = jinjalint.LintSession()
+    analyses = lexed_templates(files)
+    tokens = sum(len(analysis.lexed) for analysis in analyses)
+    start = time.perf_counter()
+    for analysis in analyses:
+        jinjalint.parse_lexed(session, analysis.lexed)
+    return (time.perf_counter() - start) / tokens * 1e6
+
+
+def print_lexed_debug_us_per_token(files) -> float:
+    """Both views of every template, as with -vv."""
+    session = jinjalint.LintSession(out=io.StringIO(), verbosity=2)
+    analyses = lexed_templates(files)
+    tokens = sum(len(analysis.lexed) for analysis in analyses)
+    start = time.perf_counter()
+    for analysis in analyses:
+        lexed, annotations = jinjalint.relocate_tokens(
+            analysis.lexed, analysis.annotations, 0, 0
+        )
+        jinjalint.print_lexed_debug(
+            session, lexed, "", analysis.parse_e, analysis.lexer_e, annotations, True
+        )
+        session.flush()
+    return (time.perf_counter() - start) / tokens * 1e6
+
+
+def files_per_second(files) -> float:
+    """LintSession.lint() on the whole corpus, memo cleared, no report."""
+    session = jinjalint.LintSession()
+    clear_memo()
+    start = time.perf_counter()
+    for path in files:
+        session.lint(path)
+    return len(files) / (time.perf_counter() - start)
+
+
+# name: (function, unit, whether higher is better)
+BENCHMARKS = {
+    "import": (import_seconds, "s", False),
+    "startup": (startup_seconds, "s", False),
+    "yaml_events": (yaml_events_per_second, "events/s", True),
+    "check_str": (check_str_per_second, "scalars/s", True),
+    "parse_lexed": (parse_lexed_us_per_token, "us/token", False),
+    "print_lexed_debug": (print_lexed_debug_us_per_token, "us/token", False),
+    "end_to_end": (files_per_second, "files/s", True),
+}
+
+
+def run(files, repeat: int) -> dict:
+    metrics = {}
+    for name, (function, unit, higher_is_better) in BENCHMARKS.items():
+        results = [function(files) for _ in range(repeat)]
+        best = max(results) if higher_is_better else min(results)
+        metrics[name] = {
+            "value": best,
+            "unit": unit,
+            "higher_is_better": higher_is_better,
+        }
+        print(f"{name:>18} {best:>12.4g} {unit}", flush=True)
+    return metrics
+
+
+def compare(old: dict, new: dict, threshold: float) -> int:
+    """Prints the change of each metric; returns the number of regressions."""
+    regressions = 0
+    print(f"{'metric':>18} {'old':>12} {'new':>12} {'change':>8}")
+    for name, metric in new["metrics"].items():
+        if name not in old["metrics"]:
+            continue
+        before, after = old["metrics"][name]["value"], metric["value"]
+        change = (after - before) / before if before else 0.0
+        worse = -change if metric["higher_is_better"] else change
+        flag = ""
+        if worse > threshold:
+            flag = "REGRESSION"
+            regressions += 1
+        line = f"{name:>18} {before:>12.4g} {after:>12.4g} {change:>+8.1%} {flag}"
+        print(line.rstrip())
+    if old["scale"] != new["scale"] or old["seed"] != new["seed"]:
+        print("note: the runs used different corpora (scale, seed)")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scale", type=int, default=1, help="corpus size multiplier")
+    parser.add_argument("--seed", type=int, default=0, help="corpus random seed")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark")
+    parser.add_argument("--corpus", type=Path, help="write the corpus here")
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    parser.add_argument("--compare", type=Path, help="results of an earlier run")
+    parser.add_argument(
+        "--threshold", type=float, default=0.10, help="regression threshold"
+    )
+    args = parser.parse_args(argv)
+    baseline = args.compare and json.loads(args.compare.read_text())
+    jinjalint.init_catalog()
+    with tempfile.TemporaryDirectory() as directory:
+        files = corpus.write_corpus(
+            args.corpus or Path(directory), args.scale, args.seed
+        )
+        metrics = run(files, args.repeat)
+    results = {
+        "python": platform.python_version(),
+        "jinjalint": subprocess.run(
+            ["git", "-C", ROOT, "describe", "--always", "--dirty"],
+            capture_output=True,
+            text=True,
+        ).stdout.strip(),
+        "scale": args.scale,
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "metrics": metrics,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+    if baseline:
+        print()
+        return int(compare(baseline, results, args.threshold) > 0)
+    return 0
+
+
+if "__main__" == __name__:
+    sys.exit(main())
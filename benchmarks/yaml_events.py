@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Compares YAML events per second from libyaml and from ruamel's pure parser.
+
+Both parsers read the same files, which are first read into memory. The libyaml
+column counts only the files it parsed itself; the rest (folded scalars, YAML
+errors) are the ones ruamel_generator() hands to the pure parser.
+
+    benchmarks/yaml_events.py [FILE ...]
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+import jinjalint  # noqa: E402
+
+
+def libyaml_events(filename, contents: str) -> int | None:
+    count = 0
+    for event in jinjalint.libyaml_events(filename, contents):
+        if event is None:
+            return None
+        count += 1
+    return count
+
+
+def pure_events(filename, contents: str) -> int:
+    count = 0
+    for event in jinjalint.pure_ruamel_generator(filename, contents):
+        count += 1
+        if isinstance(event, jinjalint.ruamel.yaml.events.StreamEndEvent):
+            break
+    return count
+
+
+def main(paths) -> int:
+    if jinjalint.LIBYAML_PARSER is None:
+        print("PyYAML with libyaml is not installed, nothing to compare")
+        return 1
+    corpus = [(path, path.read_text()) for path in paths]
+    timings = {}
+    for name, parse in (("libyaml", libyaml_events), ("pure", pure_events)):
+        events = files = 0
+        start = time.perf_counter()
+        for path, contents in corpus:
+            result = parse(path, contents)
+            if result is not None:
+                events += result
+                files += 1
+        timings[name] = (files, events, time.perf_counter() - start)
+    print(f"{'parser':>8} {'files':>6} {'events':>8} {'seconds':>9} {'events/s':>10}")
+    for name, (files, events, elapsed) in timings.items():
+        print(
+            f"{name:>8} {files:>6} {events:>8} {elapsed:>9.3f}"
+            f" {events / elapsed if elapsed else 0:>10.0f}"
+        )
+    return 0
+
+
+if "__main__" == __name__:
+    sys.exit(
+        main(
+            [Path(arg) for arg in sys.argv[1:]]
+            or sorted(Path(ROOT, "testcases").glob("**/*.yml"))
+        )
+    )
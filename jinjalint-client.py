@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""Thin client for "jinjalint.py --server".
+
+Takes the same arguments as jinjalint.py and produces the same output and exit
+status, but lets a running server do the work so we do not pay for the python
+imports and the filter catalog on every invocation. When no server is running
+the files are linted in-process instead.
+
+This script must stay cheap to start: standard library only, and jinjalint is
+imported only for the fallback.
+"""
+
+import argparse
+import json
+import os
+import socket
+import stat
+import sys
+import tempfile
+
+
+def default_socket_path() -> str:
+    """Keep in sync with default_socket_path() in jinjalint.py"""
+    if env := os.getenv("DANSABEL_SOCKET"):
+        return env
+    runtime_dir = os.getenv("XDG_RUNTIME_DIR")
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, "dansabel.sock")
+    return os.path.join(tempfile.gettempdir(), f"dansabel-{os.getuid()}.sock")
+
+
+def socket_is_ours(socket_path) -> bool:
+    """Whether (socket_path) is a socket that only we can connect to. In a shared
+    directory such as /tmp another user could have created it first, to read
+    the files we send and answer that they are fine."""
+    try:
+        st = os.stat(socket_path)
+    except OSError:
+        return False
+    if not stat.S_ISSOCK(st.st_mode):
+        return False
+    if st.st_uid != os.getuid() or st.st_mode & 0o077:
+        print(
+            f"dansabel: not using {socket_path}: it is not a socket of our own",
+            file=sys.stderr,
+        )
+        return False
+    return True
+
+
+def lint_in_process(argv, stdin_text) -> int:
+    import io
+
+    sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+    import jinjalint
+
+    if stdin_text is not None:
+        sys.stdin = io.StringIO(stdin_text)
+    return jinjalint.main(argv)
+
+
+def recv_exactly(conn, size: int) -> bytes:
+    buf = b""
+    while len(buf) < size:
+        chunk = conn.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError("server closed the connection")
+        buf += chunk
+    return buf
+
+
+def main(argv) -> int:
+    # the options we need from the ones jinjalint.py parses:
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--socket", default=default_socket_path())
+    parser.add_argument("--server", action="store_true")
+    args, _ = parser.parse_known_args(argv)
+    stdin_text = sys.stdin.read() if "-" in argv else None
+    if args.server or not socket_is_ours(args.socket):
+        return lint_in_process(argv, stdin_text)
+
+    socket_path = args.socket
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socket_path)
+    except OSError:
+        conn.close()
+        return lint_in_process(argv, stdin_text)
+
+    try:  # same detection as in jinjalint.py
+        assert os.isatty(sys.stdout.fileno())
+        columns = os.get_terminal_size().columns or 72  # it's 0 for ptys
+        tty = True
+    except Exception:
+        columns = 72
+        tty = False
+    request = {
+        "argv": argv,
+        "cwd": os.getcwd(),
+        "tty": tty,
+        "columns": columns,
+        "no_color": os.getenv("NO_COLOR") is not None,
+        "stdin": stdin_text,
+    }
+    with conn:
+        conn.sendall(json.dumps(request).encode() + b"\n")
+        while True:
+            kind = recv_exactly(conn, 1)
+            length = int.from_bytes(recv_exactly(conn, 4), "big")
+            if kind == b"X":
+                return length  # the exit status
+            stream = sys.stdout if kind == b"O" else sys.stderr
+            stream.buffer.write(recv_exactly(conn, length))
+            stream.flush()
+
+
+if "__main__" == __name__:
+    try:
+        sys.exit(main(sys.argv[1:]))
+    except ConnectionError as e:
+        print(f"dansabel: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -10,20 +10,40 @@ import textwrap
 import argparse
 import shlex
 import json
+import re
 import traceback
+import typing
 import importlib
-import ansible.plugins.filter
-import ansible.plugins.test
-import pkgutil
+import importlib.metadata
+import importlib.util
+import ast
+import bisect
+import configparser
+import contextlib
+import functools
+import hashlib
+import heapq
+import io
+import multiprocessing
+import signal
+import socket
+import subprocess
+import tempfile
+import threading
+import time
 from pathlib import Path
-import ansible_collections
-import ansible_collections.community.general.plugins.filter
+
+try:  # libyaml through PyYAML, which ansible-core depends on; see libyaml_events()
+    import yaml
+
+    LIBYAML_PARSER = yaml.CBaseLoader  # the libyaml parser; only events are used
+except (ImportError, AttributeError):  # no PyYAML, or PyYAML built without libyaml
+    LIBYAML_PARSER = None
 
 # from ansible_collections.ansible_release import ansible_version
 # ^- retrieve the ansible version we are checking against
 
-verbosity = 0
-LAST_THRESHOLD = 3  # must be >=1
+CATALOG_VERBOSE = False  # -v: report plugins that the catalog cannot list
 
 # set to False to return success when there is no parser error,
 # but jinjalint had comments; this should be a cli switch:
@@ -31,11 +51,6 @@ FAIL_WHEN_ONLY_ANNOTATIONS = True
 
 USE_COLORS = False
 
-EXTERNAL_VARIABLES: dict[str, set[str]] = dict()
-SEEN_TAGS: dict[str, set[str]] = dict()  # filename -> tags: conditionals
-ANCHORS = dict()  # aliases/anchors defined
-ALIASED_ANCHORS = dict()  # aliases/anchor used (referring to ANCHORS)
-
 VERTICAL_PIPE = "┃"
 HORIZONTAL_PIPE = "━"
 UNICODE_DOT = "•"
@@ -109,91 +124,463 @@ class Colored(collections.UserString):
         raise Exception("unhandled", str(b))
 
 
-def __vt100_color(tag, text):
-    """Wrap (text) in VT100 escape codes coloring according to (tag). Uses the xterm-256 color palette."""
-    RESET_COLOR = "\x1b[39;49;0m"
-    prefix = RESET_COLOR
-    if "data" == tag:
-        prefix = "\x1b[0m\x1b[38;5;248m"  # gray
-    elif "variable_begin" == tag or "variable_end" == tag:
-        prefix = "\x1b[38;5;91m\x1b[1m"  # purple
-    elif "operator" == tag:
-        prefix = "\x1b[36m\x1b[1m"  # green
-    elif tag in ("block_begin", "block_end", "raw_begin", "raw_end"):
-        prefix = "\x1b[38;5;208m\x1b[1m"  # orange
-    elif "LEX_ERROR" == tag:
-        prefix = "\x1b[38;5;231m\x1b[1;41m"
-    elif "BOLD" == tag:
-        prefix = "\x1b[1m"
-    elif "comment_begin" == tag or "comment" == tag or "comment_end" == tag:
-        prefix = "\x1b[38;5;165m"  # magenta/pink
-    elif tag in ("integer", "IF"):
-        prefix = "\x1b[38;5;108m\x1b[1m"  # white fg green bg
-    elif tag in ("name", "FOR"):
-        prefix = "\x1b[38;5;10m\x1b[1m"  # green (no bg)
-    elif "string" == tag:
-        prefix = "\x1b[38;5;197m\x1b[1m"  # red-ish
-    elif "whitespace" == tag or "RESET" == tag:
-        prefix = RESET_COLOR
-    elif "ERROR" == tag:
-        prefix = "\x1b[38;5;15m\x1b[1;41m"  # white fg red bg
-    elif "NOT_CONSUMED" == tag:
-        prefix = "\x1b[37;1;41m"  # white fg red bg for the first two characters
-        prefix += text[:2] + color_text("data", text[2:])
+RESET_COLOR = "\x1b[39;49;0m"
+
+# The VT100 escape codes for each tag, from the xterm-256 color palette:
+VT100_PALETTE = {
+    "data": "\x1b[0m\x1b[38;5;248m",  # gray
+    "variable_begin": "\x1b[38;5;91m\x1b[1m",  # purple
+    "variable_end": "\x1b[38;5;91m\x1b[1m",
+    "operator": "\x1b[36m\x1b[1m",  # green
+    "block_begin": "\x1b[38;5;208m\x1b[1m",  # orange
+    "block_end": "\x1b[38;5;208m\x1b[1m",
+    "raw_begin": "\x1b[38;5;208m\x1b[1m",
+    "raw_end": "\x1b[38;5;208m\x1b[1m",
+    "LEX_ERROR": "\x1b[38;5;231m\x1b[1;41m",
+    "BOLD": "\x1b[1m",
+    "comment_begin": "\x1b[38;5;165m",  # magenta/pink
+    "comment": "\x1b[38;5;165m",
+    "comment_end": "\x1b[38;5;165m",
+    "integer": "\x1b[38;5;108m\x1b[1m",  # white fg green bg
+    "IF": "\x1b[38;5;108m\x1b[1m",
+    "name": "\x1b[38;5;10m\x1b[1m",  # green (no bg)
+    "FOR": "\x1b[38;5;10m\x1b[1m",
+    "string": "\x1b[38;5;197m\x1b[1m",  # red-ish
+    "whitespace": RESET_COLOR,
+    "RESET": RESET_COLOR,
+    "ERROR": "\x1b[38;5;15m\x1b[1;41m",  # white fg red bg
+}
+# what goes before the text of each tag:
+VT100_OPEN = {tag: RESET_COLOR + prefix for tag, prefix in VT100_PALETTE.items()}
+
+
+def vt100_color(tag, text):
+    """Wrap (text) in VT100 escape codes coloring according to (tag)."""
+    if "NOT_CONSUMED" == tag:  # white fg red bg for the first two characters
+        opening = (
+            RESET_COLOR + "\x1b[37;1;41m" + text[:2] + vt100_color("data", text[2:])
+        )
         text = ""
     else:
-        output("\nBUG: please report this! unknown jinja2 lexer tag", tag)
-        sys.exit(1)
-    return f"{RESET_COLOR}{prefix}{text}{RESET_COLOR}{RESET_COLOR}"
+        opening = VT100_OPEN.get(tag)
+        if opening is None:
+            print("\nBUG: please report this! unknown jinja2 lexer tag", tag)
+            sys.exit(1)
+    return f"{opening}{text}{RESET_COLOR}{RESET_COLOR}"
 
 
-def color_text(tag, text):
+def color_text(tag, text, colors: bool) -> str:
     """Color (text) according to (text). Wobbles the indenting slightly when not using colors,
     but it should be legible."""
-    if USE_COLORS:
-        return Colored(__vt100_color(tag, text))
+    if colors:
+        return vt100_color(tag, text)
     if "NOT_CONSUMED" == tag:
         return f" -=NOT CONSUMED=- {repr(text)}"
     if "ERROR" == tag:
         return f"e {text}"
-    if "RESET" == tag:
-        return text
-    return f"{text}"
+    return text
 
 
-def output(*args, sep=" ", **kwargs):
-    """print wrapper that may be redirected in a later iteration of this tool."""
-    is_first = True
-    for element in args:
-        if is_first:
-            is_first = False
-        else:
-            output(sep, end="")
-        if isinstance(element, Colored):
-            for text, color in zip(element.strs, element.colors):
-                print(color_text(color, text), end="", sep="")
+def render(pieces, colors: bool) -> str:
+    """The text of the (text, tag) (pieces) buffered by LintSession.output(); a
+    None tag is printed as it is."""
+    return "".join(
+        [text if tag is None else color_text(tag, text, colors) for text, tag in pieces]
+    )
+
+
+class Diagnostic(typing.NamedTuple):
+    """One problem found by the linter. (line) and (column) are as displayed,
+    None when unknown; (related) holds (line, column) of other locations the
+    message refers to, e.g. the start of an unclosed block. (node_path) is the
+    path to the YAML value, as in the report, e.g. "site.yml:0.tasks.1.when"."""
+
+    file: str
+    line: int | None
+    column: int | None
+    rule: str
+    message: str
+    related: tuple[tuple[int, int], ...] = ()
+    node_path: str = ""
+
+
+class AnchorRecord(typing.NamedTuple):
+    """Where an anchor was defined (&name); check_val() keeps these instead of
+    the events, for the aliases (*name) later in the same document."""
+
+    name: str
+    file: str
+    line: int
+    column: int
+
+
+# .current: the Profile of the file being linted in this thread, for the code
+# that has no session at hand (the catalog, suggestions)
+PROFILING = threading.local()
+
+
+class Profile:
+    """Wall and CPU time per stage and file, and counts, for --profile. Stages
+    nest, and the time spent in an inner stage is not counted for the outer one:
+    the time of "check_val" is the YAML walk itself. enter() and leave() are only
+    called when the session has a profile, so the checks cost nothing otherwise."""
+
+    def __init__(self, top: int = 10):
+        self.top = top  # how many of the slowest scalars to keep
+        # (file, stage): [wall, cpu, calls]
+        self.times: dict[tuple[str, str], list] = {}
+        self.counts = collections.Counter()  # files, scalars, tokens, difflib calls...
+        self.scalars: list[tuple] = []  # heap of (seconds, line, node_path)
+        self.filename = ""  # the times are charged to this file
+        self.stack: list[str] = []  # the stages entered and not left yet
+        self.mark = (0.0, 0.0)  # the clocks when the current stage was last charged
+
+    def charge(self, stage: str) -> list:
+        """Adds the time since the last charge to (stage); returns its entry."""
+        wall, cpu = time.perf_counter(), time.thread_time()
+        entry = self.times.get((self.filename, stage))
+        if entry is None:
+            entry = self.times[(self.filename, stage)] = [0.0, 0.0, 0]
+        entry[0] += wall - self.mark[0]
+        entry[1] += cpu - self.mark[1]
+        self.mark = (wall, cpu)
+        return entry
+
+    def enter(self, stage: str) -> None:
+        if self.stack:
+            self.charge(self.stack[-1])
         else:
-            print(element, end="")
-    print("", end=kwargs.get("end", "\n"))
+            self.mark = (time.perf_counter(), time.thread_time())
+        self.stack.append(stage)
+
+    def leave(self) -> None:
+        self.charge(self.stack.pop())[2] += 1
+
+    @contextlib.contextmanager
+    def file(self, filename: str):
+        """Charges the time until the end of the block to (filename), and what
+        is not in another stage to "check_val"."""
+        previous = getattr(PROFILING, "current", None)
+        PROFILING.current = self
+        self.filename = filename
+        depth = len(self.stack)
+        self.enter("check_val")
+        try:
+            yield
+        finally:
+            while len(self.stack) > depth:  # stages left by an exception
+                self.leave()
+            PROFILING.current = previous
+
+    def timed(self, events, stage: str):
+        """The generator (events), with the time spent in it charged to (stage)."""
+        while True:
+            self.enter(stage)
+            try:
+                event = next(events)
+            except StopIteration as e:
+                self.leave()
+                return e.value
+            self.leave()
+            yield event
+
+    def keep_scalar(self, item: tuple) -> None:
+        if len(self.scalars) < self.top:
+            heapq.heappush(self.scalars, item)
+        elif item > self.scalars[0]:
+            heapq.heapreplace(self.scalars, item)
+
+    def scalar(self, seconds: float, line: int, pos_stack) -> None:
+        """Records the time check_str() took for the scalar at (pos_stack)."""
+        if len(self.scalars) < self.top or seconds > self.scalars[0][0]:
+            self.keep_scalar((seconds, line, get_node_path(pos_stack)))
+
+    def merge(self, other: "Profile") -> None:
+        for key, (wall, cpu, calls) in other.times.items():
+            entry = self.times.setdefault(key, [0.0, 0.0, 0])
+            entry[0] += wall
+            entry[1] += cpu
+            entry[2] += calls
+        self.counts.update(other.counts)
+        for item in other.scalars:
+            self.keep_scalar(item)
+
+    def print_summary(self, file=sys.stderr) -> None:
+        """The time per stage, the counts, and the slowest files and scalars."""
+        stages: dict[str, list] = {}
+        files: collections.Counter = collections.Counter()
+        for (filename, stage), (wall, cpu, calls) in self.times.items():
+            entry = stages.setdefault(stage, [0.0, 0.0, 0])
+            entry[0] += wall
+            entry[1] += cpu
+            entry[2] += calls
+            files[filename] += wall
+        total = sum(wall for wall, _, _ in stages.values())
+        print(
+            "jinjalint.py: profile: {:.3f} s wall, {:.3f} s CPU".format(
+                total, sum(cpu for _, cpu, _ in stages.values())
+            ),
+            file=file,
+        )
+        print(
+            f"{'stage':>24} {'wall s':>9} {'cpu s':>9} {'calls':>9} {'wall':>6}",
+            file=file,
+        )
+        for stage, (wall, cpu, calls) in sorted(
+            stages.items(), key=lambda item: -item[1][0]
+        ):
+            print(
+                f"{stage:>24} {wall:>9.3f} {cpu:>9.3f} {calls:>9} {wall / (total or 1):>6.1%}",
+                file=file,
+            )
+        print(
+            "jinjalint.py: profile: "
+            + ", ".join(
+                f"{self.counts[name]} {name}"
+                for name in (
+                    "files",
+                    "scalars",
+                    "tokens",
+                    "annotations",
+                    "difflib calls",
+                )
+            ),
+            file=file,
+        )
+        print(f"jinjalint.py: profile: the {self.top} slowest files:", file=file)
+        for filename, wall in files.most_common(self.top):
+            print(f"{wall:>9.3f} s  {filename}", file=file)
+        print(f"jinjalint.py: profile: the {self.top} slowest scalars:", file=file)
+        for seconds, line, node_path in sorted(self.scalars, reverse=True):
+            print(f"{seconds:>9.3f} s  {node_path} (line {line})", file=file)
+
+
+class LintSession:
+    """Everything a lint run collects: the settings, the results of the analysis
+    options, and the diagnostics. Sessions do not share state apart from the
+    catalog of known filters and tests, so each thread can lint with its own.
+
+    (out) receives the human-readable report, None to only collect diagnostics."""
+
+    def __init__(
+        self,
+        *,
+        out=None,
+        verbosity=0,
+        context_lines=3,
+        colors=False,
+        columns=72,
+        cache=None,
+        profile: Profile | None = None,
+    ):
+        self.out = out
+        self.verbosity = verbosity
+        self.context_lines = context_lines  # must be >=1
+        self.colors = colors
+        self.columns = columns
+        self.cache = cache  # a ResultCache to reuse the results for unchanged files
+        self.stats = collections.Counter()  # e.g. cache hits/misses
+        self.diagnostics: list[Diagnostic] = []
+        self.external_variables: dict[str, set[str]] = dict()
+        self.seen_tags: dict[str, set[str]] = dict()  # filename -> tags: conditionals
+        # filter_plugins/ and test_plugins/ found next to the linted files:
+        self.local_names: dict[str, set[str]] = {kind: set() for kind in PLUGIN_KINDS}
+        self.local_plugin_dirs: set[str] = set()  # directories already searched
+        self.local_names_key: tuple = ()  # hashable copy of local_names
+        self.pending: list[tuple[str, str | None]] = []  # output() until flush()
+        # the text of the file being linted, to locate block scalars:
+        self.source: str | None = None
+        self.source_starts: list[int] | None = None  # line_starts(source), lazily
+        self.profile = profile  # a Profile for --profile, None not to time anything
+
+    @property
+    def options(self) -> dict:
+        """The keyword arguments for a new session with the same settings."""
+        return dict(
+            verbosity=self.verbosity,
+            context_lines=self.context_lines,
+            colors=self.colors,
+            columns=self.columns,
+            cache=self.cache,
+            profile=self.profile and Profile(self.profile.top),
+        )
+
+    def lint(self, filename, contents: str | bytes | None = None) -> list[Diagnostic]:
+        """Lints (filename), or (contents) under that name; returns its diagnostics."""
+        first = len(self.diagnostics)
+        lint_cached(self, Path(filename), contents)
+        self.flush()
+        return self.diagnostics[first:]
+
+    def report(self, diagnostic: Diagnostic) -> None:
+        self.diagnostics.append(diagnostic)
+
+    def merge(self, other: "LintSession") -> None:
+        """Adds what (other) found, as if its files had been linted in this session."""
+        self.diagnostics.extend(other.diagnostics)
+        for filename, names in other.external_variables.items():
+            self.external_variables.setdefault(filename, set()).update(names)
+        for filename, tags in other.seen_tags.items():
+            self.seen_tags.setdefault(filename, set()).update(tags)
+        self.stats.update(other.stats)
+        if self.profile is not None and other.profile is not None:
+            self.profile.merge(other.profile)
+
+    def output(self, *args, sep=" ", end="\n"):
+        """print wrapper for (out); buffers the text until flush()."""
+        if self.out is None:
+            return
+        pieces = self.pending
+        for i, element in enumerate(args):
+            if i:
+                pieces.append((sep, None))
+            if isinstance(element, Colored):
+                pieces.extend(zip(element.strs, element.colors))
+            else:
+                pieces.append((str(element), None))
+        pieces.append((end, None))
+
+    def flush(self) -> None:
+        """Writes what output() buffered to (out), e.g. the report for a file."""
+        if self.pending:
+            if self.profile:
+                self.profile.enter("rendering")
+            self.out.write(render(self.pending, self.colors))
+            self.pending = []
+            if self.profile:
+                self.profile.leave()
 
 
 class Target(str):
     """dummy class to let us keep a .node property"""
 
 
+class TokenLine(typing.NamedTuple):
+    """One physical line of a Token."""
+
+    line: int
+    byteoff: int
+    text: str
+
+
+def line_starts(text: str) -> list[int]:
+    """The offsets in (text) where its lines start."""
+    starts = [0]
+    newline = text.find("\n")
+    while newline >= 0:
+        starts.append(newline + 1)
+        newline = text.find("\n", newline + 1)
+    return starts
+
+
+def offset_position(starts: list[int], offset: int) -> tuple[int, int]:
+    """(line, column), both counted from 1, of (offset) in the text whose
+    line_starts() are (starts)."""
+    line = bisect.bisect_right(starts, offset)
+    return line, offset - starts[line - 1] + 1
+
+
+class Token:
+    """A lexer token: source[start:end], starting at (line, byteoff).
+
+    All the tokens of a scalar share its (source) and the line_starts() of it,
+    so a token costs a few pointers instead of a dict and a list of dicts per
+    line, and its position is only looked up in (starts) when it is displayed
+    or reported; moved() adds (dline) and (dcol) to it. Its lines after the
+    first start at (margin), or where the previous one ended when (margin) is
+    None, which is how we lay out the unlexed remainder."""
+
+    __slots__ = (
+        "tag",
+        "source",
+        "starts",
+        "start",
+        "end",
+        "dline",
+        "dcol",
+        "margin",
+        "style",
+    )
+
+    def __init__(
+        self, tag, source, starts, start, end, margin=1, style="", dline=0, dcol=0
+    ):
+        self.tag = tag
+        self.source = source
+        self.starts = starts
+        self.start = start
+        self.end = end
+        self.dline = dline
+        self.dcol = dcol
+        self.margin = margin
+        self.style = style  # the quotes around the scalar, if any
+
+    @property
+    def text(self) -> str:
+        return self.source[self.start : self.end]
+
+    @property
+    def line(self) -> int:
+        return bisect.bisect_right(self.starts, self.start) + self.dline
+
+    @property
+    def byteoff(self) -> int:
+        line = bisect.bisect_right(self.starts, self.start)
+        return self.start - self.starts[line - 1] + 1 + self.dcol
+
+    @property
+    def lines(self) -> list[TokenLine]:
+        source, starts, cut, end = self.source, self.starts, self.start, self.end
+        i = bisect.bisect_right(starts, cut)
+        line, byteoff = i + self.dline, cut - starts[i - 1] + 1 + self.dcol
+        if i == len(starts) or starts[i] >= end:  # the usual, a single line
+            return [TokenLine(line, byteoff, source[cut:end])] if cut < end else []
+        lines = []
+        while cut < end:
+            if i < len(starts) and starts[i] < end:
+                text = source[cut : starts[i]]
+                i += 1
+            else:
+                text = source[cut:end]
+            cut += len(text)
+            lines.append(TokenLine(line, byteoff, text))
+            line += 1
+            if self.margin is None:
+                byteoff += len(text)
+            else:  # every line but the last ends with a newline
+                byteoff = self.margin
+        return lines
+
+    def moved(self, line: int, column: int) -> "Token":
+        """Copy of the token moved (line) lines down and (column) columns right."""
+        return Token(
+            self.tag,
+            self.source,
+            self.starts,
+            self.start,
+            self.end,
+            self.margin if self.margin is None else self.margin + column,
+            self.style,
+            self.dline + line,
+            self.dcol + column,
+        )
+
+
 def lexed_loc(item):
-    fst = item["lines"][0]
-    lst = item["lines"][-1]
+    lines = item.lines
+    fst = lines[0]
+    lst = lines[-1]
     if fst == lst:
-        return f"line {fst['line']}:{fst['byteoff']}"
-    elif fst["line"] == lst["line"]:
-        return f"line {fst['line']}:{fst['byteoff']}-{lst['byteoff']}"
+        return f"line {fst.line}:{fst.byteoff}"
+    elif fst.line == lst.line:
+        return f"line {fst.line}:{fst.byteoff}-{lst.byteoff}"
     else:
-        return f"lines {fst['line']}-{lst['line']}"
+        return f"lines {fst.line}-{lst.line}"
 
 
-def token_text(item):
-    return "".join([x["text"] for x in item["lines"]])
+def token_start(item) -> tuple[int, int]:
+    """(line, byteoff) where (item) starts."""
+    return item.line, item.byteoff
 
 
 def tokens_match(left, right):
@@ -212,30 +599,62 @@ def tokens_match(left, right):
 
 
 def is_scope_open(tok):
-    if tok["tag"].endswith("_begin"):
+    if tok.tag.endswith("_begin"):
         return True
-    return "operator" == tok["tag"] and token_text(tok) in ["[", "(", "{"]
+    return "operator" == tok.tag and tok.text in ["[", "(", "{"]
 
 
 def is_scope_close(tok):
-    if tok["tag"].endswith("_end"):
+    if tok.tag.endswith("_end"):
         return True
-    return "operator" == tok["tag"] and token_text(tok) in ["]", ")", "}"]
+    return "operator" == tok.tag and tok.text in ["]", ")", "}"]
+
+
+def next_non_whitespace(lexed) -> list[int | None]:
+    """For each token in (lexed), the index of the next token that is not
+    whitespace, or None."""
+    following: list[int | None] = [None] * len(lexed)
+    upcoming = None
+    for i in range(len(lexed) - 1, -1, -1):
+        following[i] = upcoming
+        if lexed[i].tag != "whitespace":
+            upcoming = i
+    return following
+
+
+def join_colored(pieces) -> Colored:
+    """Concatenates (pieces) like sum() would, without copying the result for
+    each piece."""
+    strs, colors = [], []
+    for piece in pieces:
+        if isinstance(piece, Colored):
+            strs += piece.strs
+            colors += piece.colors[: len(piece.strs)]
+        else:
+            strs.append(piece)
+            colors.append("RESET")
+    return Colored(None, strs=strs, colors=colors)
 
 
 def print_lexed_debug(
-    lexed, node_path, parse_e, lexer_e=None, annotations=[], debug=False
+    session,
+    lexed,
+    node_path,
+    parse_e,
+    lexer_e=None,
+    annotations=[],
+    debug_view=False,
 ):
-    if lexed and all(map(lambda x: "data" == x["tag"], lexed)):
+    """Prints the inline view of (lexed) and, with (debug_view), the per-token
+    view after it. Both views are rendered in the same pass over the tokens."""
+    if (lexed and all(map(lambda x: "data" == x.tag, lexed))) or (
+        # Target, not Exception (we always print parser exceptions)
+        # skip when there are no parser exceptions and no annotations
+        not isinstance(parse_e, Exception) and not annotations and not session.verbosity
+    ):
+        if debug_view:
+            session.output("\n" + "~" * session.columns)
         return
-    if not isinstance(
-        parse_e, Exception
-    ):  # Target, not Exception (we always print parser exceptions)
-        if (
-            not annotations
-        ):  # skip when there are no parser exceptions and no annotations
-            if not verbosity:
-                return
     relevant_lines = set()
 
     # first we try to establish which lines we are interested in looking at:
@@ -244,377 +663,1053 @@ def print_lexed_debug(
         marked_lines.add(parse_e.lineno)
     if lexer_e and lexer_e.lineno:
         marked_lines.add(lexer_e.lineno)
+    token_annotations = {}  # id() of a token: its annotations
     for annot in annotations:
+        token_annotations.setdefault(id(annot["tok"]), []).append(annot)
         # go out on a limb and assume annotations will exist in (lexed)
         # find all annotations for this token
-        for lin in annot["tok"]["lines"]:
-            marked_lines.add(lin["line"])
+        for lin in annot["tok"].lines:
+            marked_lines.add(lin.line)
             # if the helpful message is referring to another line,
             # ensure we also display that:
             for related_tok in annot["related_tokens"]:
-                for rel_line in related_tok["lines"]:
-                    marked_lines.add(rel_line["line"])
+                for rel_line in related_tok.lines:
+                    marked_lines.add(rel_line.line)
     for lineno in marked_lines:
         relevant_lines.update(
-            range(lineno - LAST_THRESHOLD, lineno + LAST_THRESHOLD + 1)
+            range(lineno - session.context_lines, lineno + session.context_lines + 1)
         )
     for line in relevant_lines.copy():  # copy because we update it:
         # remove one-line gaps; just print the line instead of "skipped 1 line":
         if line - 2 in relevant_lines:
             relevant_lines.add(line - 1)
-    if verbosity:
-        relevant_lines.update(range(0, lexed[-1]["lines"][-1]["line"] + 2))
+    if session.verbosity:
+        relevant_lines.update(range(0, lexed[-1].lines[-1].line + 2))
 
+    following = next_non_whitespace(lexed)
+    previous = None  # the last token before (tok) that is not whitespace
     open_tag_stack = []
     next_scope_transition = []
     current_line = 0
-    linebuf = Colored("")  # buffers one line of output
+    linebuf = [Colored("")]  # buffers one line of output
+    debug_linebuf = [Colored("")]  # the same for the per-token view
+    debug_output = []  # print() arguments for the per-token view, printed last
     last_printed = 0
     for idx, tok in enumerate(lexed):
         if is_scope_open(tok):
-            nextnwsp = first_non_whitespace(lexed[idx + 1 :])
-            if nextnwsp and nextnwsp["tag"] == "name":
-                if token_text(nextnwsp) in ("if",):  # elif stays in same scope
+            nextnwsp = lexed[following[idx]] if following[idx] is not None else None
+            if nextnwsp and nextnwsp.tag == "name":
+                if nextnwsp.text in ("if",):  # elif stays in same scope
                     next_scope_transition.append((len(open_tag_stack), "IF"))
-                elif token_text(nextnwsp) in ("for",):
+                elif nextnwsp.text in ("for",):
                     next_scope_transition.append((len(open_tag_stack), "FOR"))
                 elif open_tag_stack:
-                    if (
-                        token_text(nextnwsp) == "endfor" and open_tag_stack[-1] == "FOR"
-                    ) or (
-                        token_text(nextnwsp) == "endif" and open_tag_stack[-1] == "IF"
+                    if (nextnwsp.text == "endfor" and open_tag_stack[-1] == "FOR") or (
+                        nextnwsp.text == "endif" and open_tag_stack[-1] == "IF"
                     ):
-                        open_tag_stack = open_tag_stack[:-1]
-            open_tag_stack.append(tok["tag"])
+                        open_tag_stack.pop()
+            open_tag_stack.append(tok.tag)
         indent_level = len(open_tag_stack)
         offset = 14 + 2 * (indent_level)
-        if is_scope_close(tok):
-            open_tag_stack = open_tag_stack[:-1]  # .pop() without exception
+        if is_scope_close(tok) and open_tag_stack:
+            open_tag_stack.pop()
+        tok_annotations = token_annotations.get(id(tok), ())
 
-        for lin in tok["lines"]:
-            is_new_line = lin["line"] != current_line
+        for lin in tok.lines:
+            is_new_line = lin.line != current_line
             if is_new_line:
                 if current_line in relevant_lines:
-                    skipped = current_line + min(
-                        -1 - last_printed, -lexed[0]["lines"][0]["line"]
-                    )
+                    skipped = current_line + min(-1 - last_printed, -lexed[0].line)
                     if skipped > 0:  # for first line will be -1
-                        if debug:
-                            output()  # blank line for the debug view
-                        output(
+                        skip_note = (
                             (UNICODE_DOT * 3).rjust(11)
                             + " ("
                             + str(skipped)
-                            + " lines)",
-                            end=(not debug and "\n" or ""),
+                            + " lines)"
                         )
+                        session.output(skip_note)
+                        # blank line for the debug view:
+                        debug_output += [((), "\n"), ((skip_note,), "")]
                     last_printed = current_line
-                    output(linebuf, end="")
-                linebuf = Colored("")
-                current_line = lin["line"]
+                    session.output(join_colored(linebuf), end="")
+                    debug_output.append(((join_colored(debug_linebuf),), ""))
+                linebuf = [Colored("")]
+                debug_linebuf = [Colored("")]
+                current_line = lin.line
 
             line_color = "data"
-            if tok in map(lambda atok: atok["tok"], annotations):
-                # TODO use a set instead, this is slow
+            if tok_annotations:
                 line_color = "comment"
             if lexer_e and current_line == lexer_e.lineno:
                 line_color = "LEX_ERROR"
             if parse_e and current_line == parse_e.lineno:
                 line_color = "ERROR"
 
-            if not debug:  # this is the inline display:
-                if is_new_line:
-                    linebuf += Colored(str(current_line).ljust(5), line_color)
-                wrap = tok.get("style", "")
-                linebuf += Colored(wrap + lin.get("text") + wrap, tok["tag"])
-                if "NOT_CONSUMED" == tok["tag"]:
-                    break  # only print the first unlexed line
-                continue
+            # this is the inline display:
+            if is_new_line:
+                linebuf.append(Colored(str(current_line).ljust(5), line_color))
+            wrap = tok.style
+            linebuf.append(Colored(wrap + lin.text + wrap, tok.tag))
 
-            transformed = repr(lin["text"])[
-                1:-1
-            ]  # strip single-quotes that repr() always adds
-            transformed = transformed.replace("\\n", "↵")
-            if (abs(last_printed - current_line) <= 1) and tok["tag"] in (
-                "whitespace",
-                "data",
-            ):
-                # Tack insignificant tokens onto the end of the previous token display.
-                # We don't do this for the first line, or after skipping.
-                linebuf += Colored(" " + transformed + " ", tok["tag"])
-                continue
-            else:
-                linebuf += Colored("\n")
-            linebuf += Colored(
-                str(lin["line"]).rjust(4) + ":" + str(lin["byteoff"]).ljust(3),
-                line_color,
-            )
-            for color_tag in open_tag_stack[:-1]:
-                linebuf += Colored(VERTICAL_PIPE + " ", color_tag)
-            if is_scope_close(tok):
-                if open_tag_stack:
-                    linebuf += Colored(VERTICAL_PIPE + " ", open_tag_stack[-1])
-                linebuf += Colored("┗" + HORIZONTAL_PIPE, tok["tag"])
-            elif is_scope_open(tok):
-                linebuf += Colored("┏" + HORIZONTAL_PIPE, tok["tag"])
-            else:
-                tag = open_tag_stack and open_tag_stack[-1] or tok["tag"]
-                linebuf += Colored("┣" + HORIZONTAL_PIPE, tag)
-            linebuf += Colored(HORIZONTAL_PIPE * (indent_level), tok["tag"])
-            linebuf += (
-                Colored(HORIZONTAL_PIPE * (offset - len(tok["tag"])), tok["tag"]) + " "
-            )
-            linebuf += tok["tag"] + ": "
-            wrap = tok.get("style", "")
-            linebuf += Colored(wrap + transformed + wrap, tok["tag"])
-            for annot in filter(lambda x: x["tok"] == tok, annotations):
-                for msg in textwrap.wrap(
-                    "\u269e " + annot["comment"] + "\u269f",
-                    width=max(8, OUT_COLS - offset),
+            if debug_view:
+                transformed = repr(lin.text)[
+                    1:-1
+                ]  # strip single-quotes that repr() always adds
+                transformed = transformed.replace("\\n", "↵")
+                if (abs(last_printed - current_line) <= 1) and tok.tag in (
+                    "whitespace",
+                    "data",
                 ):
-                    linebuf += "\n" + " " * offset
-                    linebuf += Colored(msg, "comment")
-            if "NOT_CONSUMED" == tok["tag"]:
+                    # Tack insignificant tokens onto the end of the previous token display.
+                    # We don't do this for the first line, or after skipping.
+                    debug_linebuf.append(Colored(" " + transformed + " ", tok.tag))
+                else:
+                    debug_linebuf.append(Colored("\n"))
+                    debug_linebuf.append(
+                        Colored(
+                            str(lin.line).rjust(4) + ":" + str(lin.byteoff).ljust(3),
+                            line_color,
+                        )
+                    )
+                    for color_tag in open_tag_stack[:-1]:
+                        debug_linebuf.append(Colored(VERTICAL_PIPE + " ", color_tag))
+                    if is_scope_close(tok):
+                        if open_tag_stack:
+                            debug_linebuf.append(
+                                Colored(VERTICAL_PIPE + " ", open_tag_stack[-1])
+                            )
+                        debug_linebuf.append(Colored("┗" + HORIZONTAL_PIPE, tok.tag))
+                    elif is_scope_open(tok):
+                        debug_linebuf.append(Colored("┏" + HORIZONTAL_PIPE, tok.tag))
+                    else:
+                        tag = open_tag_stack and open_tag_stack[-1] or tok.tag
+                        debug_linebuf.append(Colored("┣" + HORIZONTAL_PIPE, tag))
+                    debug_linebuf += [
+                        Colored(HORIZONTAL_PIPE * (indent_level), tok.tag),
+                        Colored(HORIZONTAL_PIPE * (offset - len(tok.tag)), tok.tag),
+                        " ",
+                        tok.tag + ": ",
+                        Colored(wrap + transformed + wrap, tok.tag),
+                    ]
+                    for annot in tok_annotations:
+                        for msg in textwrap.wrap(
+                            "\u269e " + annot["comment"] + "\u269f",
+                            width=max(8, session.columns - offset),
+                        ):
+                            debug_linebuf.append("\n" + " " * offset)
+                            debug_linebuf.append(Colored(msg, "comment"))
+            if "NOT_CONSUMED" == tok.tag:
                 break  # only print the first unlexed line
         # we're still looping over tokens, here we effectuate the changed scope when leaving a block:
-        if (
-            idx - 1 >= 0
-            and (nwsp := first_non_whitespace(lexed[idx - 1 :: -1]))
-            and is_scope_close(nwsp)
-        ):
+        if previous and is_scope_close(previous):
             for nst_idx, (scope_len, typ) in enumerate(next_scope_transition):
                 if len(open_tag_stack) == scope_len:
                     open_tag_stack.append(typ)
                     del next_scope_transition[nst_idx]
+        if tok.tag not in ("whitespace",):
+            previous = tok
 
     if current_line in relevant_lines:
-        output(linebuf, end="")
-    if debug:  # display with syntax highlighting inline
-        output(Colored("\n" + HORIZONTAL_PIPE * OUT_COLS, "string"))
-        if parse_e or lexer_e:
-            if parse_e:
-                output(
-                    f"{UNICODE_DOT} {node_path}",
-                    parse_e.lineno,
-                    Colored("jinja parser", "ERROR"),
-                    Colored(parse_e.message, "ERROR"),
-                    sep=f" {VERTICAL_PIPE} ",
-                )
-            if lexer_e:
-                output(
-                    f"{UNICODE_DOT} {node_path}",
-                    lexer_e.lineno,
-                    lexer_e.lex_col,
-                    Colored("jinja lexer", "LEX_ERROR"),
-                    Colored(lexer_e.message, "LEX_ERROR"),
-                    sep=f" {VERTICAL_PIPE} ",
-                )
-        else:
-            output(f"{UNICODE_DOT} {node_path}")
-        output(Colored(HORIZONTAL_PIPE * OUT_COLS, "string"))
-    elif verbosity == 1:
+        session.output(join_colored(linebuf), end="")
+        debug_output.append(((join_colored(debug_linebuf),), ""))
+    if session.verbosity == 1:
         # TODO == 1 prevents the double printing when verbosity>=2; this could be prettier.
-        output(Colored("\n" + HORIZONTAL_PIPE * OUT_COLS, "string"))
-        output(f"{UNICODE_DOT} {node_path}")
-        output(Colored(HORIZONTAL_PIPE * OUT_COLS, "string"))
+        session.output(Colored("\n" + HORIZONTAL_PIPE * session.columns, "string"))
+        session.output(f"{UNICODE_DOT} {node_path}")
+        session.output(Colored(HORIZONTAL_PIPE * session.columns, "string"))
+    if not debug_view:
+        return
+    # separate the inline view from per-token listing:
+    session.output("\n" + "~" * session.columns)
+    for args, end in debug_output:
+        session.output(*args, end=end)
+    # display with syntax highlighting inline
+    session.output(Colored("\n" + HORIZONTAL_PIPE * session.columns, "string"))
+    if parse_e or lexer_e:
+        if parse_e:
+            session.output(
+                f"{UNICODE_DOT} {node_path}",
+                parse_e.lineno,
+                Colored("jinja parser", "ERROR"),
+                Colored(parse_e.message, "ERROR"),
+                sep=f" {VERTICAL_PIPE} ",
+            )
+        if lexer_e:
+            session.output(
+                f"{UNICODE_DOT} {node_path}",
+                lexer_e.lineno,
+                lexer_e.lex_col,
+                Colored("jinja lexer", "LEX_ERROR"),
+                Colored(lexer_e.message, "LEX_ERROR"),
+                sep=f" {VERTICAL_PIPE} ",
+            )
+    else:
+        session.output(f"{UNICODE_DOT} {node_path}")
+    session.output(Colored(HORIZONTAL_PIPE * session.columns, "string"))
 
 
-def load_ansible_collections_filters():
-    for f in Path(ansible_collections.__path__[0]).glob("**/plugins/filter/*.py"):
-        if f.stem.startswith("_"):
+# Plugin kinds we track: the class ansible instantiates and the method listing names.
+PLUGIN_KINDS = {"filter": ("FilterModule", "filters"), "test": ("TestModule", "tests")}
+
+
+def ansible_config():
+    """Returns the ansible.cfg ansible itself would pick, parsed, or None.
+    https://docs.ansible.com/ansible/latest/reference_appendices/config.html#the-configuration-file
+    """
+    global _ANSIBLE_CONFIG
+    if _ANSIBLE_CONFIG is not False:
+        return _ANSIBLE_CONFIG
+    _ANSIBLE_CONFIG = None
+    candidates = []
+    if env := os.getenv("ANSIBLE_CONFIG"):
+        env = os.path.expanduser(env)
+        candidates.append(
+            os.path.join(env, "ansible.cfg") if os.path.isdir(env) else env
+        )
+    candidates += [
+        "ansible.cfg",
+        os.path.expanduser("~/.ansible.cfg"),
+        "/etc/ansible/ansible.cfg",
+    ]
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            cfg = configparser.ConfigParser(interpolation=None)
+            try:
+                cfg.read(candidate)
+            except configparser.Error:
+                continue
+            cfg.dansabel_dir = os.path.dirname(os.path.abspath(candidate))
+            _ANSIBLE_CONFIG = cfg
+            break
+    return _ANSIBLE_CONFIG
+
+
+_ANSIBLE_CONFIG = False  # not looked up yet
+
+
+def ansible_config_paths(env_names, cfg_keys, default: str) -> list[str]:
+    """Resolves a colon-separated path setting the way ansible does: environment
+    variables first, then [defaults] in ansible.cfg, then (default)."""
+    value = None
+    for env_name in env_names:
+        if value := os.getenv(env_name):
+            break
+    base = os.getcwd()
+    if not value and (cfg := ansible_config()):
+        for cfg_key in cfg_keys:
+            if value := cfg.get("defaults", cfg_key, fallback=None):
+                base = cfg.dansabel_dir
+                break
+    return [
+        os.path.join(base, os.path.expanduser(p))
+        for p in (value or default).split(os.pathsep)
+        if p
+    ]
+
+
+def ansible_collections_paths() -> list[str]:
+    """Directories named ansible_collections: the installed python package (found
+    without importing it) followed by the configured collections_path entries."""
+    paths = []
+    try:
+        spec = importlib.util.find_spec("ansible_collections")
+    except (ImportError, ValueError):
+        spec = None
+    paths.extend((spec and spec.submodule_search_locations) or [])
+    for p in ansible_config_paths(
+        ("ANSIBLE_COLLECTIONS_PATH", "ANSIBLE_COLLECTIONS_PATHS"),
+        ("collections_path", "collections_paths"),
+        "~/.ansible/collections:/usr/share/ansible/collections",
+    ):
+        if os.path.basename(p.rstrip(os.sep)) != "ansible_collections":
+            p = os.path.join(p, "ansible_collections")
+        if os.path.isdir(p) and p not in paths:
+            paths.append(p)
+    return paths
+
+
+def collection_namespaces(kind: str) -> list[str]:
+    """Lists "namespace.collection" names of installed collections that ship (kind)
+    plugins."""
+    namespaces = []
+    for base in ansible_collections_paths():
+        for ns in os.scandir(base):
+            if not ns.is_dir() or ns.name.startswith(("_", ".")):
+                continue
+            for coll in os.scandir(ns.path):
+                if os.path.isdir(os.path.join(coll.path, "plugins", kind)):
+                    namespaces.append(f"{ns.name}.{coll.name}")
+    return sorted(set(namespaces))
+
+
+def _scope_assignments(statements) -> dict[str, list]:
+    """Maps variable names to the AST nodes that contribute keys to them:
+    assigned values, arguments to .update(), and {key: ...} for x[key] = ..."""
+    scope: dict[str, list] = {}
+    for node in statements:
+        if isinstance(node, (ast.Assign, ast.AnnAssign)) and node.value:
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            for target in targets:
+                if isinstance(target, ast.Name):
+                    scope.setdefault(target.id, []).append(node.value)
+                elif isinstance(target, ast.Subscript) and isinstance(
+                    target.value, ast.Name
+                ):
+                    scope.setdefault(target.value.id, []).append(
+                        ast.Dict(keys=[target.slice], values=[node.value])
+                    )
+        elif (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Attribute)
+            and node.func.attr == "update"
+            and isinstance(node.func.value, ast.Name)
+        ):
+            scope.setdefault(node.func.value.id, []).extend(node.args)
+    return scope
+
+
+def _static_keys(node, scopes, depth=0) -> set[str] | None:
+    """Statically evaluates the keys of the dict expression (node), or None when that
+    would require running the code.
+    (scopes) is (function locals, class attributes, module globals)."""
+    local_scope, class_scope, module_scope = scopes
+    if depth > 10 or node is None:
+        return None
+    keys: set[str] | None = set()
+    if isinstance(node, ast.Dict):
+        for key, value in zip(node.keys, node.values):
+            if key is None:  # {**other}
+                keys = _union(keys, _static_keys(value, scopes, depth + 1))
+            elif isinstance(key, ast.Constant) and isinstance(key.value, str):
+                keys.add(key.value)
+            else:
+                return None
+        return keys
+    if isinstance(node, (ast.List, ast.Tuple, ast.Set)):  # iterated by a comprehension
+        for elt in node.elts:
+            if not (isinstance(elt, ast.Constant) and isinstance(elt.value, str)):
+                return None
+            keys.add(elt.value)
+        return keys
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitOr):
+        return _union(
+            _static_keys(node.left, scopes, depth + 1),
+            _static_keys(node.right, scopes, depth + 1),
+        )
+    if isinstance(node, ast.Name):
+        contributions = local_scope.get(node.id) or module_scope.get(node.id)
+    elif (
+        isinstance(node, ast.Attribute)
+        and isinstance(node.value, ast.Name)
+        and node.value.id in ("self", "cls")
+    ):
+        contributions = class_scope.get(node.attr)
+    elif isinstance(node, ast.DictComp) or (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Name)
+        and node.func.id == "dict"
+        and len(node.args) == 1
+        and isinstance(node.args[0], (ast.GeneratorExp, ast.ListComp))
+    ):
+        # {f: ... for f in self.filter_map} / dict((f, ...) for f in ...):
+        comp = node if isinstance(node, ast.DictComp) else node.args[0]
+        key = comp.key if isinstance(comp, ast.DictComp) else comp.elt
+        if isinstance(key, ast.Tuple) and key.elts:
+            key = key.elts[0]
+        gen = comp.generators[0]
+        if (
+            len(comp.generators) == 1
+            and not gen.ifs
+            and isinstance(key, ast.Name)
+            and isinstance(gen.target, ast.Name)
+            and key.id == gen.target.id
+        ):
+            return _static_keys(gen.iter, scopes, depth + 1)
+        return None
+    elif (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Name)
+        and node.func.id == "dict"
+    ):
+        for arg in node.args:
+            keys = _union(keys, _static_keys(arg, scopes, depth + 1))
+        for kw in node.keywords:
+            if kw.arg is None:  # dict(**other)
+                keys = _union(keys, _static_keys(kw.value, scopes, depth + 1))
+            elif keys is not None:
+                keys.add(kw.arg)
+        return keys
+    else:
+        return None
+    if not contributions:
+        return None
+    for contribution in contributions:
+        keys = _union(keys, _static_keys(contribution, scopes, depth + 1))
+    return keys
+
+
+def _union(left: set[str] | None, right: set[str] | None) -> set[str] | None:
+    if left is None or right is None:
+        return None
+    return left | right
+
+
+def plugin_names_from_source(source: bytes | str, kind: str) -> set[str] | None:
+    """Extracts the names returned by FilterModule.filters() / TestModule.tests()
+    without running the plugin. Returns None when the names are computed in a way
+    we cannot follow statically."""
+    class_name, method = PLUGIN_KINDS[kind]
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+    module_scope = _scope_assignments(tree.body)
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)) and any(
+            alias.asname == class_name or alias.name == class_name
+            for alias in node.names
+        ):
+            return None  # re-exported from elsewhere
+        if not (isinstance(node, ast.ClassDef) and node.name == class_name):
             continue
-        if sys.version_info >= (3, 4):
-            # As best that i can tell this changed in 3.4 when pathlib was included [Quien Sabe]
-            parts = list(f.parts[f.parts.index("ansible_collections") :])
+        class_scope = _scope_assignments(node.body)
+        for fn in node.body:
+            if not (isinstance(fn, ast.FunctionDef) and fn.name == method):
+                continue
+            local_scope = _scope_assignments(ast.walk(fn))
+            scopes = (local_scope, class_scope, module_scope)
+            names = None
+            for ret in ast.walk(fn):
+                if isinstance(ret, ast.Return):
+                    found = _static_keys(ret.value, scopes)
+                    # "if HAS_LIB: return {...} else: return {}" - we take what we can get:
+                    if found is not None:
+                        names = (names or set()) | found
+            return names
+        return None  # inherited method
+    return set()  # no plugin class here, probably a helper module
+
+
+def import_plugin_names(path: Path, kind: str, modname: str | None = None) -> set[str]:
+    """The slow path: runs the plugin module (path) to ask it for its names."""
+    class_name, method = PLUGIN_KINDS[kind]
+    try:
+        if modname:
+            mod = importlib.import_module(modname)
         else:
-            parts = f._parts[f._parts.index("ansible_collections") :]
-        parts[-1] = parts[-1].replace(".py", "")
+            spec = importlib.util.spec_from_file_location(
+                f"_dansabel_{kind}_plugin_{path.stem}", path
+            )
+            mod = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(mod)
+        return set(getattr(getattr(mod, class_name)(), method)())
+    except Exception as e:
+        if CATALOG_VERBOSE:
+            print(f"dansabel: cannot list {kind}s in {path}: {e!r}", file=sys.stderr)
+        return set()
+
+
+def plugin_dir_names(directory, kind: str, package: str | None = None) -> set[str]:
+    """Names of the (kind) plugins in (directory). Each module is parsed statically,
+    falling back to importing it (as part of (package) if given)."""
+    profile = getattr(PROFILING, "current", None)
+    if profile:
+        profile.enter("ansible imports")
+    names: set[str] = set()
+    for f in sorted(Path(directory).glob("*.py")):
+        if f.stem.startswith("_"):
+            continue
         try:
-            mod = importlib.import_module(".".join(parts), package=ansible_collections)
-        except ImportError:
+            source = f.read_bytes()
+        except OSError:
             continue
-        filters = mod.FilterModule().filters().keys()
-        filter_ns = (
-            ".".join(parts[1:-3]) + "."
-        )  # skip 'ansible_collections/' and 'plugins/filters'
-        for fname in filters:
-            yield fname
-            yield filter_ns + fname
+        found = plugin_names_from_source(source, kind)
+        if found is None:
+            found = import_plugin_names(f, kind, package and f"{package}.{f.stem}")
+        names.update(found)
+    if profile:
+        profile.leave()
+    return names
+
+
+def load_ansible_collections_plugins(namespace: str, kind: str) -> set[str]:
+    """Returns the (kind) plugin names of a single collection, e.g. "community.general"."""
+    names: set[str] = set()
+    for base in ansible_collections_paths():
+        plugin_dir = Path(base, *namespace.split("."), "plugins", kind)
+        if not plugin_dir.is_dir():
+            continue
+        if os.path.dirname(base) not in sys.path:
+            # lets the import fallback find collections from collections_path:
+            sys.path.append(os.path.dirname(base))
+        names.update(
+            plugin_dir_names(
+                plugin_dir,
+                kind,
+                ".".join(["ansible_collections", namespace, "plugins", kind]),
+            )
+        )
+    return names
 
 
 # "XXX is YYY(...)" where YYY is a test and ... is zero or more arguments:
 # https://jinja.palletsprojects.com/en/3.0.x/templates/#builtin-tests
 JINJA_BUILTIN_TESTS = set(jinja2.tests.TESTS)
 
-# https://docs.ansible.com/ansible/latest/user_guide/playbooks_tests.html
-# https://github.com/ansible/ansible/blob/devel/lib/ansible/plugins/test/core.py#L235
-ANSIBLE_BUILTIN_TESTS = set().union(
-    *[
-        set(
-            importlib.import_module("ansible.plugins.test." + name).TestModule().tests()
-        )
-        for loader, name, is_pkg in pkgutil.walk_packages(ansible.plugins.test.__path__)
-    ]
-)
-
 JINJA_BUILTIN_FILTERS = set(jinja2.filters.FILTERS)
 
-ANSIBLE_BUILTIN_FILTERS: set[str] = set()
-ANSIBLE_BUILTIN_FILTERS = ANSIBLE_BUILTIN_FILTERS.union(
-    load_ansible_collections_filters()
-)
-ANSIBLE_BUILTIN_FILTERS.update(
-    {
+# Bump this when build_catalog() changes what it records:
+CATALOG_VERSION = 3
+
+
+def catalog_path() -> Path:
+    """Location of the on-disk filter/test catalog (honours XDG_CACHE_HOME)."""
+    cache_home = os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return Path(cache_home) / "dansabel" / "catalog.json"
+
+
+def catalog_key() -> dict:
+    """Describes the environment the catalog was built from. Computing this must stay
+    cheap, so we look up versions and directories without importing ansible."""
+    versions = {}
+    for dist in ("ansible-core", "ansible", "jinja2"):
+        try:
+            versions[dist] = importlib.metadata.version(dist)
+        except importlib.metadata.PackageNotFoundError:
+            versions[dist] = None
+    mtimes = {}
+    for base in ansible_collections_paths():
+        # installing, removing or upgrading a collection touches these directories:
+        for ns in os.scandir(base):
+            if not ns.is_dir():
+                continue
+            mtimes[ns.path] = ns.stat().st_mtime_ns
+            for coll in os.scandir(ns.path):
+                if coll.is_dir():
+                    mtimes[coll.path] = coll.stat().st_mtime_ns
+    return {
+        "catalog_version": CATALOG_VERSION,
+        "python": list(sys.version_info[:2]),
+        "versions": versions,
+        "collection_mtimes": mtimes,
+    }
+
+
+def build_catalog() -> dict:
+    """Finds the names of the ansible-core filter and test plugins."""
+    try:
+        spec = importlib.util.find_spec("ansible")
+    except (ImportError, ValueError):
+        spec = None
+    plugins_dir = Path(
+        *(spec and spec.submodule_search_locations or ["/nonexistent"])[:1], "plugins"
+    )
+    # https://docs.ansible.com/ansible/latest/user_guide/playbooks_tests.html
+    # https://github.com/ansible/ansible/blob/devel/lib/ansible/plugins/test/core.py#L235
+    ansible_builtin_tests = plugin_dir_names(
+        plugins_dir / "test", "test", "ansible.plugins.test"
+    )
+    ansible_builtin_filters = plugin_dir_names(
+        plugins_dir / "filter", "filter", "ansible.plugins.filter"
+    )
+
+    # https://github.com/ansible/ansible/blob/2058ea59915655d71bf5bd9d3f7e318ffec3c658/lib/ansible/template/__init__.py#L649-L653
+    # ^-- the hardcoded values above are currenty not accounted for.
+
+    # Here we find 'd', 'e', etc (2025-10-17: jk: does not seem to be needed for ansible >= 12 )
+    # Imported here whether or not the plugins above were, so the catalog does not
+    # depend on what happened to be imported:
+    try:
+        import ansible.template
+
+        mock_template_env = ansible.template.AnsibleEnvironment()
+    except (ImportError, AttributeError):
+        pass
+    else:
+        ansible_builtin_filters.update(mock_template_env.filters)
+        ansible_builtin_tests.update(set(mock_template_env.tests))
+
+    return {
+        "key": catalog_key(),
         # These are accesible both with their free-standing name and namespaced as "ansible.builtin."
         # https://docs.ansible.com/ansible/latest/collections/ansible/builtin/index.html#filter-plugins
-        prefix + key
-        for loader, name, is_pkg in pkgutil.walk_packages(
-            ansible.plugins.filter.__path__
+        "filters": sorted(
+            {
+                prefix + name
+                for name in ansible_builtin_filters
+                for prefix in ("", "ansible.builtin.")
+            }
+            | {"lookup", "query", "now", "undef"}
+        ),
+        "tests": sorted(
+            prefix + name
+            for name in ansible_builtin_tests
+            for prefix in ("", "ansible.builtin.")
+        ),
+        # filled in by resolve_namespace() as collections are referenced:
+        "collections": {kind: {} for kind in PLUGIN_KINDS},
+    }
+
+
+def write_json(data, path: Path) -> None:
+    """Atomically replaces (path) so concurrent runs never see a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp.", suffix=".json")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def load_catalog(rebuild=False) -> dict:
+    """Returns the cached catalog of ansible filters/tests, (re)building it when it is
+    missing, stale (the environment changed) or when (rebuild) is requested."""
+    path = catalog_path()
+    key = catalog_key()
+    if not rebuild:
+        try:
+            with open(path) as f:
+                catalog = json.load(f)
+            if catalog.get("key") == key:
+                return catalog
+        except (OSError, ValueError):
+            pass
+    catalog = build_catalog()
+    try:
+        write_json(catalog, path)
+    except OSError:
+        pass  # read-only home directory etc; we will just rebuild next time
+    return catalog
+
+
+# BUILTIN_* also collects collection plugins as they are resolved:
+BUILTIN_TESTS: set[str] = set()
+BUILTIN_FILTERS: set[str] = set()
+KNOWN_NAMES = {"filter": BUILTIN_FILTERS, "test": BUILTIN_TESTS}
+CATALOG: dict = {}
+RESOLVED_NAMESPACES: dict[str, set[str]] = {kind: set() for kind in PLUGIN_KINDS}
+ALL_NAMESPACES_RESOLVED: set[str] = set()  # kinds for which every collection is loaded
+# the catalog is shared by the sessions, this serializes loading it:
+CATALOG_LOCK = threading.RLock()
+
+
+def user_plugin_dirs() -> list[tuple[str, str]]:
+    """(kind, directory) of the existing user-wide plugin directories from the
+    ansible configuration, e.g. ~/.ansible/plugins/filter."""
+    dirs = []
+    for kind, env_name, cfg_key in (
+        ("filter", "ANSIBLE_FILTER_PLUGINS", "filter_plugins"),
+        ("test", "ANSIBLE_TEST_PLUGINS", "test_plugins"),
+    ):
+        for plugin_dir in ansible_config_paths(
+            (env_name,),
+            (cfg_key,),
+            f"~/.ansible/plugins/{kind}:/usr/share/ansible/plugins/{kind}",
+        ):
+            if os.path.isdir(plugin_dir):
+                dirs.append((kind, plugin_dir))
+    return dirs
+
+
+def init_catalog(rebuild=False) -> None:
+    """Populates BUILTIN_TESTS/BUILTIN_FILTERS; cheap after the first call.
+    Collection plugins are added lazily by resolve_namespace()."""
+    if CATALOG and not rebuild:
+        return
+    with CATALOG_LOCK:
+        if CATALOG and not rebuild:
+            return  # another thread loaded it while we waited
+        catalog = load_catalog(rebuild=rebuild)
+        BUILTIN_TESTS.clear()
+        BUILTIN_TESTS.update(JINJA_BUILTIN_TESTS, catalog["tests"])
+        BUILTIN_FILTERS.clear()
+        BUILTIN_FILTERS.update(JINJA_BUILTIN_FILTERS, catalog["filters"])
+        for kind in PLUGIN_KINDS:
+            RESOLVED_NAMESPACES[kind].clear()
+        ALL_NAMESPACES_RESOLVED.clear()
+        for kind, plugin_dir in user_plugin_dirs():
+            KNOWN_NAMES[kind].update(plugin_dir_names(plugin_dir, kind))
+        for index in SUGGESTION_INDEXES.values():
+            index.reset()
+        CATALOG.clear()
+        CATALOG.update(catalog)  # last, the other threads go by CATALOG being set
+
+
+def namespace_installed(namespace: str, kind: str) -> bool:
+    """Whether the collection (namespace) is installed with (kind) plugins; only
+    looks for the directory."""
+    return any(
+        os.path.isdir(os.path.join(base, *namespace.split("."), "plugins", kind))
+        for base in ansible_collections_paths()
+    )
+
+
+def resolve_namespace(namespace: str, kind: str = "filter") -> None:
+    """Adds the (kind) plugins of collection (namespace) to BUILTIN_FILTERS or
+    BUILTIN_TESTS, both with their free-standing name and prefixed with the
+    namespace. The names are recorded in the on-disk catalog for later runs."""
+    init_catalog()
+    if namespace in RESOLVED_NAMESPACES[kind]:
+        return
+    with CATALOG_LOCK:
+        if namespace in RESOLVED_NAMESPACES[kind]:
+            return
+        known = CATALOG["collections"][kind]
+        if namespace not in known:
+            if not namespace_installed(namespace, kind):
+                # e.g. a typo: nothing to load, nor to record in the catalog
+                RESOLVED_NAMESPACES[kind].add(namespace)
+                return
+            known[namespace] = sorted(load_ansible_collections_plugins(namespace, kind))
+            try:
+                write_json(CATALOG, catalog_path())
+            except OSError:
+                pass
+        for name in known[namespace]:
+            KNOWN_NAMES[kind].add(name)
+            KNOWN_NAMES[kind].add(namespace + "." + name)
+        RESOLVED_NAMESPACES[kind].add(namespace)
+
+
+def resolve_all_namespaces(kind: str = "filter") -> None:
+    """Needed for free-standing names, which may come from any collection."""
+    if kind in ALL_NAMESPACES_RESOLVED:
+        return
+    init_catalog()
+    with CATALOG_LOCK:
+        if kind in ALL_NAMESPACES_RESOLVED:
+            return
+        known = CATALOG["collections"][kind]
+        pending = [ns for ns in collection_namespaces(kind) if ns not in known]
+        for namespace in pending:
+            known[namespace] = sorted(load_ansible_collections_plugins(namespace, kind))
+        if pending:
+            try:
+                write_json(CATALOG, catalog_path())
+            except OSError:
+                pass
+        for namespace in list(known):
+            resolve_namespace(namespace, kind)
+        ALL_NAMESPACES_RESOLVED.add(kind)
+
+
+def is_known(name: str, kind: str = "filter") -> bool:
+    """Looks up (name) among the known (kind) plugins, loading collections only when
+    needed: "community.general.json_query" loads only community.general, while an
+    unknown free-standing name loads all of them."""
+    init_catalog()
+    if name in KNOWN_NAMES[kind]:
+        return True
+    parts = name.split(".")
+    if len(parts) > 2:
+        resolve_namespace(".".join(parts[:2]), kind)
+        return name in KNOWN_NAMES[kind]
+    resolve_all_namespaces(kind)
+    return name in KNOWN_NAMES[kind]
+
+
+def close_matches(word: str, counts: dict, n: int, cutoff: float) -> list:
+    """The (ratio, name) pairs behind difflib.get_close_matches(word, counts, n,
+    cutoff), best first. (counts) maps each candidate name to a Counter of its
+    characters, from which we get quick_ratio(), an upper bound of ratio(). The
+    candidates are tried in order of that bound, and once no remaining one can
+    beat the n best so far we skip their (expensive) ratio()."""
+    profile = getattr(PROFILING, "current", None)
+    if profile:
+        profile.counts["difflib calls"] += 1
+    word_counts = collections.Counter(word)
+    bounds = []
+    for name, name_counts in counts.items():
+        total = len(word) + len(name)
+        if total and 2.0 * min(len(word), len(name)) / total < cutoff:
+            continue  # real_quick_ratio()
+        matches = sum(
+            min(count, name_counts[char]) for char, count in word_counts.items()
         )
-        for key in importlib.import_module("ansible.plugins.filter." + name)
-        .FilterModule()
-        .filters()
-        .keys()
-        for prefix in ("", "ansible.builtin.")
-    },
-    {"lookup", "query", "now", "undef"},
+        bound = 2.0 * matches / total if total else 1.0
+        if bound >= cutoff:
+            bounds.append((bound, name))
+    bounds.sort(reverse=True)
+    matcher = difflib.SequenceMatcher()
+    matcher.set_seq2(word)
+    best: list[tuple[float, str]] = []  # heap of the n best so far
+    for bound, name in bounds:
+        if len(best) == n and bound < best[0][0]:
+            break  # ties are broken by name, so only a lower bound rules them out
+        matcher.set_seq1(name)
+        ratio = matcher.ratio()
+        if ratio < cutoff:
+            continue
+        if len(best) < n:
+            heapq.heappush(best, (ratio, name))
+        else:
+            heapq.heappushpop(best, (ratio, name))
+    return sorted(best, reverse=True)
+
+
+class SuggestionIndex:
+    """close_matches() for a collection of (names) that may grow, like
+    BUILTIN_FILTERS when collections are resolved. The character counts are
+    computed once per name, and the suggestions for a word are memoized until
+    (names) changes. The catalog lock also protects the index, since resolving
+    collections adds names while we read them."""
+
+    MEMO_SIZE = 10000
+
+    def __init__(self, names):
+        self.names = names
+        self.counts: dict[str, collections.Counter] = {}
+        self.memo: dict = {}
+
+    def reset(self) -> None:
+        """For when (names) may have changed without changing size."""
+        with CATALOG_LOCK:
+            self.counts.clear()
+            self.memo.clear()
+
+    def close_matches(self, word: str, n: int, cutoff: float) -> list:
+        with CATALOG_LOCK:
+            if len(self.counts) != len(self.names):
+                for name in self.counts.keys() - set(self.names):
+                    del self.counts[name]
+                for name in self.names:
+                    if name not in self.counts:
+                        self.counts[name] = collections.Counter(name)
+                self.memo.clear()
+            key = (word, n, cutoff)
+            if key not in self.memo:
+                if len(self.memo) >= self.MEMO_SIZE:
+                    self.memo.clear()
+                self.memo[key] = close_matches(word, self.counts, n, cutoff)
+            return self.memo[key]
+
+
+def suggest(word: str, kind: str, local_names=(), n=2, cutoff=0.1) -> list[str]:
+    """difflib.get_close_matches(word, KNOWN_NAMES[kind] | local_names, n, cutoff)"""
+    resolve_all_namespaces(kind)  # is_known() may have loaded only one of them
+    matches = SUGGESTION_INDEXES[kind].close_matches(word, n, cutoff)
+    if local_names:
+        counts = {
+            name: collections.Counter(name)
+            for name in local_names
+            if name not in KNOWN_NAMES[kind]
+        }
+        matches = heapq.nlargest(n, matches + close_matches(word, counts, n, cutoff))
+    return [name for _, name in matches]
+
+
+SUGGESTION_INDEXES = {
+    kind: SuggestionIndex(names) for kind, names in KNOWN_NAMES.items()
+}
+
+# https://docs.ansible.com/ansible/latest/user_guide/playbooks_conditionals.html#ansible-facts-distribution
+DISTRIBUTIONS = SuggestionIndex(
+    (
+        "Alpine",
+        "Altlinux",
+        "Amazon",
+        "Archlinux",
+        "ClearLinux",
+        "Coreos",
+        "CentOS",
+        "Debian",
+        "Fedora",
+        "Gentoo",
+        "Mandriva",
+        "NA",
+        "OpenWrt",
+        "OracleLinux",
+        "RedHat",
+        "Slackware",
+        "SLES",
+        "SMGL",
+        "SUSE",
+        "Ubuntu",
+        "VMwareESX",  # extras:
+        "Kali",
+        "OpenSUSE",
+        "FreeBSD",
+        "Red Hat Enterprise Linux",
+    )
 )
-# https://github.com/ansible/ansible/blob/2058ea59915655d71bf5bd9d3f7e318ffec3c658/lib/ansible/template/__init__.py#L649-L653
-# ^-- the hardcoded values above are currenty not accounted for.
 
-# Here we find 'd', 'e', etc (2025-10-17: jk: does not seem to be needed for ansible >= 12 )
-try:
-    mock_template_env = ansible.template.AnsibleEnvironment()
-except AttributeError:
-    pass
-else:
-    ANSIBLE_BUILTIN_FILTERS.update(mock_template_env.filters)
-    ANSIBLE_BUILTIN_TESTS.update(set(mock_template_env.tests))
 
-BUILTIN_TESTS = JINJA_BUILTIN_TESTS.union(ANSIBLE_BUILTIN_TESTS)
-BUILTIN_FILTERS = JINJA_BUILTIN_FILTERS.union(ANSIBLE_BUILTIN_FILTERS)
+def is_known_filter(name: str) -> bool:
+    return is_known(name, "filter")
 
 
-def first_non_whitespace(tok_list):
-    for tok in tok_list:
-        if tok["tag"] in (r"whitespace",):
-            continue
-        return tok
+def is_known_test(name: str) -> bool:
+    return is_known(name, "test")
+
+
+def discover_local_plugins(session, filename: Path) -> None:
+    """Adds the filters/tests from filter_plugins/ and test_plugins/ directories next to
+    (filename) or in one of its parent directories, which is where ansible looks
+    for them in roles and next to playbooks, to the (session). We stop at the root
+    of the git repository."""
+    init_catalog()
+    directory = Path(os.path.abspath(filename)).parent
+    for parent in (directory, *directory.parents):
+        if str(parent) in session.local_plugin_dirs:
+            break  # this one and its parents were searched for a previous file
+        session.local_plugin_dirs.add(str(parent))
+        for kind in PLUGIN_KINDS:
+            plugin_dir = parent / f"{kind}_plugins"
+            if plugin_dir.is_dir():
+                session.local_names[kind].update(plugin_dir_names(plugin_dir, kind))
+                session.local_names_key = tuple(
+                    frozenset(session.local_names[kind]) for kind in PLUGIN_KINDS
+                )
+        if (parent / ".git").exists():
+            break
 
 
-def parse_lexed(lexed) -> list[dict[str, str | list]]:
-    begins = []
+def parse_lexed(session, lexed) -> list[dict[str, str | list]]:
+    """Runs our heuristics over the tokens; each of them only looks at a few
+    tokens around the current one, so this is linear in len(lexed)."""
+    init_catalog()
+    local_names = session.local_names
+    following = next_non_whitespace(lexed)
+    begins = []  # stack of open scopes
+    open_ids = set()  # id() of the tokens in (begins)
+    brace_begins = []  # the tokens in (begins) starting with "{", in the same order
     recommendations = []
+
+    def push(token):
+        begins.append(token)
+        open_ids.add(id(token))
+        if token.text.startswith("{"):
+            brace_begins.append(token)
+
+    def pop():
+        token = begins.pop()
+        open_ids.discard(id(token))
+        if brace_begins and brace_begins[-1] is token:
+            brace_begins.pop()
+        return token
+
+    def non_whitespace_after(i):
+        """Yields (index, token) for the tokens after lexed[i], skipping whitespace."""
+        j = following[i]
+        while j is not None:
+            yield j, lexed[j]
+            j = following[j]
+
     for i in range(len(lexed)):
         tok = lexed[i]
-        tok_text = token_text(tok)
+        tok_text = tok.text
         this_token_closed = None  # ref to popped begins[-1] if any
 
-        def recommend(comment, token=lexed[i], related=[]):
+        def recommend(rule, comment, token=lexed[i], related=[]):
             recommendations.append(
-                {"tok": token, "comment": comment, "related_tokens": related}
+                {
+                    "tok": token,
+                    "rule": rule,
+                    "comment": comment,
+                    "related_tokens": related,
+                }
             )
 
         ## This looks for "filters", aka tag {name} following {operator "|"}:
         if is_scope_open(tok):
-            if tok["tag"] == "block_begin":
-                next = first_non_whitespace(lexed[i + 1 :])
-                if next:
-                    next_text = token_text(next)
-                    if next_text == "if":
-                        begins.append(next)
-                    elif next_text == "for":
-                        begins.append(next)
-                    elif next_text == "elif":
-                        popped = begins.pop()
-                        if token_text(popped) not in ("elif"):
+            if tok.tag == "block_begin" and following[i] is not None:
+                next = lexed[following[i]]
+                next_text = next.text
+                if next_text == "if":
+                    push(next)
+                elif next_text == "for":
+                    push(next)
+                elif next_text == "elif":
+                    popped = pop()
+                    if popped.text not in ("elif"):
+                        recommend(
+                            "block-mismatch",
+                            f'elif must not end a "{popped.text}" scope',
+                            token=next,
+                            related=[popped],
+                        )
+                    push(next)
+                elif next_text in ("endif", "endfor"):
+                    # we have endif/endfor, ensure they close the right scope:
+                    popped = None
+                    try:
+                        popped = pop()  # TODO should be a 'endif'
+                    except IndexError:
+                        recommend(
+                            "unopened-block",
+                            "block closure, but no block scope is open",
+                            token=next,
+                            related=[tok],
+                        )
+                    if popped:
+                        if ("endfor" == next_text and popped.text not in ("for",)) or (
+                            "endif" == next_text and popped.text not in ("if", "elif")
+                        ):
                             recommend(
-                                f'elif must not end a "{token_text(popped)}" scope',
+                                "block-mismatch",
+                                f'{next_text} cannot not end a "{popped.text}" scope',
                                 token=next,
                                 related=[popped],
                             )
-                        begins.append(next)
-                    elif next_text in ("endif", "endfor"):
-                        # we have endif/endfor, ensure they close the right scope:
-                        popped = None
-                        try:
-                            popped = begins.pop()  # TODO should be a 'endif'
-                        except IndexError:
-                            recommend(
-                                "block closure, but no block scope is open",
-                                token=next,
-                                related=[tok],
-                            )
-                        if popped:
-                            if (
-                                "endfor" == next_text
-                                and token_text(popped) not in ("for",)
-                            ) or (
-                                "endif" == next_text
-                                and token_text(popped) not in ("if", "elif")
-                            ):
-                                recommend(
-                                    f'{next_text} cannot not end a "{token_text(popped)}" scope',
-                                    token=next,
-                                    related=[popped],
-                                )
-            begins.append(tok)
+            push(tok)
         elif is_scope_close(tok):
             try:
                 this_token_closed = (
-                    begins.pop()
+                    pop()
                 )  # TODO should pop last matching type; anything else is an error
             except IndexError:
-                recommend("No matching start of this block.", related=[tok])
+                recommend(
+                    "unopened-block", "No matching start of this block.", related=[tok]
+                )
             else:
-                if not tokens_match(token_text(this_token_closed), tok_text):
-                    recommend("Unclosed block?", related=[this_token_closed])
-        if "operator" == tok["tag"] and tok_text == "|":
+                if not tokens_match(this_token_closed.text, tok_text):
+                    recommend(
+                        "unclosed-block", "Unclosed block?", related=[this_token_closed]
+                    )
+        if "operator" == tok.tag and tok_text == "|":
             # We expect a filter to follow. Filters are either 'name'
             # or they are 'name' 'operator .' 'name', ...
-            next_lexed = lexed[i + 1 :]
-            for next_idx, next in enumerate(next_lexed):
-                # skipping whitespace, TODO comments?
-                if next["tag"] in ("whitespace",):
-                    continue
-                if "operator" == next["tag"]:
-                    if "|" == token_text(
-                        next
-                    ):  # "||" results in two operators '|','|':
+            # skipping whitespace, TODO comments?
+            for next_idx, next in non_whitespace_after(i):
+                if "operator" == next.tag:
+                    if "|" == next.text:  # "||" results in two operators '|','|':
                         recommendations.append(
                             {
                                 "tok": next,
                                 "related_tokens": [tok],
+                                "rule": "or-pipes",
                                 "comment": 'Did you mean "or" ?',
                             }
                         )
                         break
-                elif "name" == next["tag"]:
+                elif "name" == next.tag:
                     tag_suffix = []
-                    while len(next_lexed) - next_idx > 1 and (
-                        next_lexed[next_idx + 1]["tag"] == "operator"
-                        and token_text(next_lexed[next_idx + 1]) == "."
+                    while len(lexed) - next_idx > 1 and (
+                        lexed[next_idx + 1].tag == "operator"
+                        and lexed[next_idx + 1].text == "."
                     ):
                         next_idx += 2
-                        if next_lexed[next_idx]["tag"] == "name":
-                            tag_suffix.append(token_text(next_lexed[next_idx]))
+                        if lexed[next_idx].tag == "name":
+                            tag_suffix.append(lexed[next_idx].text)
                         else:
                             break
-                    this_text = token_text(next)
+                    this_text = next.text
                     if tag_suffix:
                         this_text = ".".join([this_text, *tag_suffix])
-                    if this_text in BUILTIN_FILTERS:
+                    if this_text in local_names["filter"] or is_known_filter(this_text):
                         break
-                    suggest = ", ".join(
-                        difflib.get_close_matches(
-                            this_text, BUILTIN_FILTERS, 2, cutoff=0.1
-                        )
+                    suggestions = ", ".join(
+                        suggest(this_text, "filter", local_names["filter"])
                     )
                     recommendations.append(
                         {
                             "tok": next,
                             "related_tokens": [],
-                            "comment": "Not a builtin filter? Maybe: " + suggest,
+                            "rule": "unknown-filter",
+                            "comment": "Not a builtin filter? Maybe: " + suggestions,
                         }
                     )
                 else:
@@ -622,17 +1717,19 @@ def parse_lexed(lexed) -> list[dict[str, str | list]]:
                         {
                             "tok": next,
                             "related_tokens": [],
+                            "rule": "filter-name-expected",
                             "comment": "Expecting filter name after |, not: "
-                            + next["tag"],
+                            + next.tag,
                         }
                     )
                 break
-        elif "NOT_CONSUMED" == tok["tag"]:
+        elif "NOT_CONSUMED" == tok.tag:
             if tok_text.startswith("&&"):
                 recommendations.append(
                     {
                         "tok": tok,
                         "related_tokens": [],
+                        "rule": "and-ampersands",
                         "comment": 'Did you mean "and" ?',
                     }
                 )
@@ -640,53 +1737,61 @@ def parse_lexed(lexed) -> list[dict[str, str | list]]:
         if i + 1 == len(lexed):
             continue
         if (
-            "operator" == tok["tag"]
-            and "operator" == lexed[i + 1]["tag"]
-            and lexed[i] not in begins
+            "operator" == tok.tag
+            and "operator" == lexed[i + 1].tag
+            and id(lexed[i]) not in open_ids
         ):
             # recommend('Two operators in a row?')
-            if "{" == token_text(lexed[i]) and begins:
+            if "{" == lexed[i].text and begins:
                 recommend(
+                    "nested-tags",
                     "Did you forget to close this? Nested tags found.",
-                    token=begins[-1]["lines"][0],
+                    token=begins[-1],
                 )
-        elif "operator" == tok["tag"] and "}" == tok_text:
-            cand = list(filter(lambda x: token_text(x).startswith("{"), begins))
-            if cand and not (
-                this_token_closed
-                and tokens_match(token_text(this_token_closed), tok_text)
+        elif "operator" == tok.tag and "}" == tok_text:
+            if brace_begins and not (
+                this_token_closed and tokens_match(this_token_closed.text, tok_text)
             ):
                 recommend(
+                    "single-brace",
                     'Found single "}" operator at '
                     + lexed_loc(lexed[i])
                     + ", did you mean to close "
-                    + repr(token_text(cand[0]))
+                    + repr(brace_begins[0].text)
                     + " at "
-                    + lexed_loc(cand[0])
+                    + lexed_loc(brace_begins[0])
                     + "?",
-                    related=[cand[0]],  # mark for display
+                    related=[brace_begins[0]],  # mark for display
                 )
-        elif "name" == tok["tag"] and tok_text in ("is", "ansible_distribution"):
+        elif "name" == tok.tag and tok_text in ("is", "ansible_distribution"):
             next_i = -1
-            for next in lexed[i + 1 :]:
-                if next["tag"] in ("whitespace",):
-                    continue
+            for next_idx, next in non_whitespace_after(i):
                 next_i += 1  # next_i is like enumerate(lexed), but skipping whitespace
                 if "is" == tok_text:
-                    if next_i == 0 and token_text(next) == "not":
+                    if next_i == 0 and next.text == "not":
                         continue
-                    if token_text(next) in BUILTIN_TESTS:
+                    test_name = next.text
+                    # collection tests are namespaced: "is ansible.utils.in_network"
+                    while (
+                        "name" == next.tag
+                        and next_idx + 2 < len(lexed)
+                        and lexed[next_idx + 1].tag == "operator"
+                        and lexed[next_idx + 1].text == "."
+                        and lexed[next_idx + 2].tag == "name"
+                    ):
+                        next_idx += 2
+                        test_name += "." + lexed[next_idx].text
+                    if test_name in local_names["test"] or is_known_test(test_name):
                         break
-                    suggest = ", ".join(
-                        difflib.get_close_matches(
-                            token_text(next), BUILTIN_TESTS, 2, cutoff=0.1
-                        )
+                    suggestions = ", ".join(
+                        suggest(test_name, "test", local_names["test"])
                     )
                     recommendations.append(
                         {
                             "tok": next,
                             "related_tokens": [tok],
-                            "comment": "Not a builtin Test? Maybe: " + suggest,
+                            "rule": "unknown-test",
+                            "comment": "Not a builtin Test? Maybe: " + suggestions,
                         }
                     )
                     break
@@ -695,48 +1800,20 @@ def parse_lexed(lexed) -> list[dict[str, str | list]]:
                     # (name:ansible_distribution)
                     # (operator tokens) / (whitespace tokens)
                     # (string:next)
-                    if next["tag"] in ("operator",):
+                    if next.tag in ("operator",):
                         continue
-                    if "string" == next["tag"]:
-                        distro = token_text(next).strip(r'"\'')
-                        # source:
-                        # https://docs.ansible.com/ansible/latest/user_guide/playbooks_conditionals.html#ansible-facts-distribution
-                        suggests = difflib.get_close_matches(
-                            distro,
-                            (
-                                "Alpine",
-                                "Altlinux",
-                                "Amazon",
-                                "Archlinux",
-                                "ClearLinux",
-                                "Coreos",
-                                "CentOS",
-                                "Debian",
-                                "Fedora",
-                                "Gentoo",
-                                "Mandriva",
-                                "NA",
-                                "OpenWrt",
-                                "OracleLinux",
-                                "RedHat",
-                                "Slackware",
-                                "SLES",
-                                "SMGL",
-                                "SUSE",
-                                "Ubuntu",
-                                "VMwareESX",  # extras:
-                                "Kali",
-                                "OpenSUSE",
-                                "FreeBSD",
-                                "Red Hat Enterprise Linux",
-                            ),
-                            cutoff=0.25,
-                        )
+                    if "string" == next.tag:
+                        distro = next.text.strip(r'"\'')
+                        suggests = [
+                            name
+                            for _, name in DISTRIBUTIONS.close_matches(distro, 3, 0.25)
+                        ]
                         if distro not in suggests:
                             recommendations.append(
                                 {
                                     "tok": next,
                                     "related_tokens": [tok],
+                                    "rule": "unknown-distribution",
                                     "comment": f"Did you mean {suggests} ?",
                                 }
                             )
@@ -746,11 +1823,12 @@ def parse_lexed(lexed) -> list[dict[str, str | list]]:
 
     if begins:
         # TODO only warn if there's no lexer error?
-        # if not any(filter(lambda x: 'NOT_CONSUMED' == x['tag'] and '}' in token_text(x), lexed)):
+        # if not any(filter(lambda x: 'NOT_CONSUMED' == x['tag'] and '}' in x.text, lexed)):
         recommendations.insert(
             0,
             {
                 "tok": begins[-1],
+                "rule": "unclosed-block",
                 "comment": "This may be an unclosed block?",
                 "related_tokens": [],
             },
@@ -769,25 +1847,140 @@ def get_node_path(pos_stack) -> str:
     return node_path
 
 
-def check_str(
-    yaml_node, pos_stack, *, wrap_in_jinja_brackets=False, key: str | None = None
-) -> bool:
-    """
-    wrap_in_jinja_brackets: force jinja to consider the payload an expression by wrapping in {{ }}
+def approximate_size(obj, seen: set | None = None) -> int:
+    """sys.getsizeof() including the contents of containers, and the text and
+    line_starts() that the tokens of a scalar share, counted once (seen holds
+    the id() of those already counted)."""
+    if seen is None:
+        seen = set()
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(
+            approximate_size(k, seen) + approximate_size(v, seen)
+            for k, v in obj.items()
+        )
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approximate_size(item, seen) for item in obj)
+    elif isinstance(obj, Token):
+        for shared in (obj.source, obj.starts):
+            if shared is not None and id(shared) not in seen:
+                seen.add(id(shared))
+                size += approximate_size(shared, seen)
+    return size
 
-    returns True on error, False on success"""
-    if wrap_in_jinja_brackets:
-        s = "{{" + yaml_node.value + "}}"
-    else:
-        s = yaml_node.value
+
+class ScalarMemo:
+    """Bounded LRU memo of the position-independent results of check_str(), since
+    the same scalars ("{{ item }}", "item.name is defined") recur in many files.
+    Shared by all sessions, like the catalog."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries: collections.OrderedDict = collections.OrderedDict()
+        self.nbytes = 0  # approximate memory used by the entries
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, analysis) -> None:
+        if not self.maxsize:  # --memo-size 0: the memo is disabled
+            return
+        size = approximate_size(key[0]) + approximate_size(analysis)
+        with self.lock:
+            if key in self.entries:  # e.g. now with the tokens
+                self.nbytes -= self.entries.pop(key)[1]
+            self.entries[key] = (analysis, size)
+            self.nbytes += size
+            while self.entries and len(self.entries) > self.maxsize:
+                _, (_, size) = self.entries.popitem(last=False)
+                self.nbytes -= size
+
+
+SCALAR_MEMO = ScalarMemo(4096)
+
+
+class ScalarAnalysis(typing.NamedTuple):
+    """What check_str() found in a scalar, as if it started at line 0, column 0."""
+
+    parse_e: object  # Target, TemplateSyntaxError, or None when redundant
+    lexer_e: object  # Target or TemplateSyntaxError
+    lexed: list | None  # None when it parsed and the AST showed nothing to report
+    annotations: list  # from parse_lexed(), referencing tokens in (lexed)
+    resolved: list  # variables jinja would need to resolve from the environment
+
+
+# "{%+", "+%}", "{% raw %}" etc: delimiters tokens_match() does not pair up
+UNUSUAL_DELIMITERS = re.compile(r"\{[{%#]\+|\+[}%#]\}|raw")
+# whitespace in a dotted name, e.g. "x | ansible . builtin . quote": parse_lexed()
+# stops at the whitespace, so it sees another name than the parser
+SPACED_DOT = re.compile(r"\w\s+\.|\.\s+\w")
+# delimiters in a value we wrapped in {{ }}, e.g. "when: x == 0 }}", which pair up
+# with the ones we added:
+WRAPPED_DELIMITERS = re.compile(r"\{\{|\}\}|\{%|%\}")
+
+
+def node_strings(node):
+    """The names and other strings held directly by the jinja2 AST (node)."""
+    for field in node.fields:
+        value = getattr(node, field, None)
+        if isinstance(value, str):
+            yield value
+        elif isinstance(value, (list, tuple)):  # e.g. FromImport.names
+            for item in value:
+                if isinstance(item, str):
+                    yield item
+                elif isinstance(item, tuple):
+                    yield from (x for x in item if isinstance(x, str))
+
+
+def needs_token_pass(session, jinja_template, s: str, wrapped: bool) -> bool:
+    """Whether parse_lexed() could find anything in (s), which parsed as
+    (jinja_template), (wrapped) in {{ }} by us or not. Checks the filters and
+    tests in the AST; errs on the side of True for what only the tokens can tell."""
+    if wrapped and (
+        WRAPPED_DELIMITERS.search(s, 2, len(s) - 2)
+        or s.startswith("-", 2)
+        or s.endswith("-", 0, len(s) - 2)
+    ):
+        return True  # the value closes or trims the {{ }} we added
+    if "\r" in s or "ansible_distribution" in s or UNUSUAL_DELIMITERS.search(s):
+        # newlines the lexer rewrites; the distribution check; unpaired delimiters
+        return True
+    local_names = session.local_names
+    dotted = False
+    for node in jinja_template.find_all(jinja2.nodes.Node):
+        if isinstance(node, jinja2.nodes.Filter):
+            if node.name not in local_names["filter"] and not is_known_filter(
+                node.name
+            ):
+                return True
+            dotted |= "." in node.name
+        elif isinstance(node, jinja2.nodes.Test):
+            if node.name not in local_names["test"] and not is_known_test(node.name):
+                return True
+            dotted |= "." in node.name
+        elif "is" in node_strings(node):
+            return True  # "x.is", "f(is=1)": parse_lexed() takes it for a test
+    return dotted and bool(SPACED_DOT.search(s))
+
+
+def analyze_scalar(
+    session, s: str, style, wrap_in_jinja_brackets, lex=False
+) -> ScalarAnalysis:
+    """Parses (s) and, if that fails, the AST has something to report, or (lex),
+    also lexes it to run parse_lexed() and locate what it found."""
+    session.stats["parsed scalars"] += 1
     parse_e = Target()
     parse_e.lineno = 0  # elsewhere we treat 'not lineno' as lack of information
     lexer_e = Target()
     lexer_e.lineno = 0  # defined here because we may to lift an exc out of its scope
-    node_path = get_node_path(pos_stack)
-
-    file_line = yaml_node.start_mark.line
-    file_line += int(yaml_node.style in (">", "|"))  # adjust start location offset
+    resolved = []
 
     # TODO: '>' is "folded" style, where newlines are supposed to be replaced by spaces.
     # in ruamel that means turning \x0a into \x07\x0a. I don't think Jinja2 cares,
@@ -795,13 +1988,15 @@ def check_str(
     # here, our locs will be correct; if we replace them with spaces we need to special
     # case that in the line tracker below to keep the correspondence between Jinja2 errors
     # and physical location. Thus our solution for now will be:
-    if yaml_node.style == ">":
+    if style == ">":
         s = s.replace("\x07", "\n")
+    profile = session.profile
+    if profile:
+        profile.enter("jinja parse")
     try:
         jinja_template = JINJA2_SANDBOX_ENVIRON.parse(
-            source=s, name=node_path, filename="JINJA_TODO_FILENAME_SEEMS_UNUSED"
+            source=s, filename="JINJA_TODO_FILENAME_SEEMS_UNUSED"
         )
-        # TODO good place to return False if we don't care about non-parser errors
     except jinja2.TemplateSyntaxError as parse_e_exc:
         parse_e = parse_e_exc
     else:
@@ -811,127 +2006,339 @@ def check_str(
             if "resolve" == ref[0]:
                 # ref[1] contains the variable name of a variable that jinja
                 # would need to resolve from the environment.
-                filename = pos_stack[0][2].rstrip(":")
-                EXTERNAL_VARIABLES[filename] = EXTERNAL_VARIABLES.get(filename, set())
-                EXTERNAL_VARIABLES[filename].add(ref[1])
+                resolved.append(ref[1])
+        if not lex and not needs_token_pass(
+            session, jinja_template, s, wrap_in_jinja_brackets
+        ):
+            return ScalarAnalysis(parse_e, lexer_e, None, [], resolved)
+    finally:
+        if profile:
+            profile.leave()
+    session.stats["lexed scalars"] += 1
 
     # OK! Gloves off! We are going to run it through the lexer to retrieve
     # more information and hopefully be able to be helpful.
-    # Idea here is to line it up so (file_line + lex_line) is the actual
-    # line in the file, and (lex_col) is the actual column in the file.
-    # The lex_line variable represents our attempt to follow the lexer.
-
-    parse_e.lineno = file_line + parse_e.lineno
+    # Idea here is to line it up so (file_line + line) is the actual line in
+    # the file, and (column) is the actual column in the file; check_str() adds
+    # the position of the scalar to both.
     consumed = 0
-
-    lex_line = 1
-    lex_col = yaml_node.start_mark.column + 1
     lexed = []
+    # The lexer normalizes newlines, so its tokens are slices of the concatenation
+    # of their values rather than of (s):
+    values = []
+    wrap = style if style in ('"', "'") else ""
+    if profile:
+        profile.enter("jinja lex")
     try:
         for rawtok in JINJA2_SANDBOX_ENVIRON.lex(source=s):
-            consumed += len(rawtok[2])
+            text = rawtok[2]
+            values.append(text)
+            start = consumed
+            consumed += len(text)
             if wrap_in_jinja_brackets and consumed in (2, len(s)):
                 # ignore the {{ and }} we add to force when: to be an expression
                 continue
-            token = {"tag": rawtok[1], "lines": []}
-            if getattr(yaml_node, "style") in ('"', "'"):
-                token["style"] = yaml_node.style
-
-            for lineno, text in enumerate(rawtok[2].splitlines(True)):
-                token["lines"].append(
-                    {"line": file_line + lex_line, "byteoff": lex_col, "text": text}
-                )
-                if text.endswith("\n"):
-                    lex_line += 1
-                    lex_col = yaml_node.start_mark.column + 1
-                else:
-                    lex_col += len(text)
-            lexed.append(token)
+            lexed.append(Token(rawtok[1], None, None, start, consumed, 1, wrap))
     except jinja2.exceptions.TemplateSyntaxError as lex_e_exc:
         if parse_e.message == lex_e_exc.message:  # ignore redundant msgs
             parse_e = None
         lexer_e = lex_e_exc
-        lexer_e.lineno = lexer_e.lineno + file_line
-        lexer_e.colno = consumed + yaml_node.start_mark.column
+    source = "".join(values)
+    starts = line_starts(source)
+    if wrap_in_jinja_brackets:
+        starts[0] = 2  # the {{ we added is not displayed; the line starts after it
+    for token in lexed:
+        token.source = source
+        token.starts = starts
+    line, column = offset_position(starts, consumed)
+    if isinstance(lexer_e, Exception):
+        lexer_e.colno = consumed
         # TODO with >, offset seems to be off by one, unlike |
-        lexer_e.lex_col = lex_col
+        lexer_e.lex_col = column
     if (consumed + 1 == len(s)) and "\n" == s[-1]:
         pass  # ignore these trailing newlines
     elif consumed < len(s):
-        not_consumed: dict[str, str | list[dict[str, int | str]]] = {
-            "tag": "NOT_CONSUMED",
-            "lines": [],
-        }
-        for lin in s[consumed:].splitlines(True):
-            not_consumed["lines"].append(
-                {"line": file_line + lex_line, "byteoff": lex_col, "text": lin}
+        # laid out from where the lexer stopped, though it is a slice of (s):
+        remainder_starts = line_starts(s)
+        remainder_starts[0] = starts[0]
+        remainder_line, remainder_column = offset_position(remainder_starts, consumed)
+        lexed.append(
+            Token(
+                "NOT_CONSUMED",
+                s,
+                remainder_starts,
+                consumed,
+                len(s),
+                margin=None,
+                dline=line - remainder_line,
+                dcol=column - remainder_column,
             )
-            lex_line += 1
-            lex_col += len(lin)
-        lexed.append(not_consumed)
-    annotations = parse_lexed(lexed)
+        )
+    if profile:
+        profile.leave()
+        profile.counts["tokens"] += len(lexed)
+        profile.enter("parse_lexed")
+    annotations = parse_lexed(session, lexed)
+    if profile:
+        profile.leave()
+    return ScalarAnalysis(parse_e, lexer_e, lexed, annotations, resolved)
+
+
+def relocate_error(e, line: int, column: int):
+    """Copy of the error (e) from analyze_scalar() moved to (line, column)."""
+    if e is None:
+        return None
+    if isinstance(e, Target):
+        moved = Target()
+    else:
+        moved = jinja2.TemplateSyntaxError(e.message, e.lineno, e.name, e.filename)
+        if hasattr(e, "lex_col"):
+            moved.colno = e.colno + column
+            moved.lex_col = e.lex_col + column
+    moved.lineno = e.lineno + line
+    return moved
+
+
+def relocate_tokens(lexed, annotations, line: int, column: int):
+    """Copies of the tokens from analyze_scalar() and of the (annotations) on them
+    moved to (line, column)."""
+    moved = {}
+
+    def move(token):
+        if id(token) not in moved:
+            moved[id(token)] = token.moved(line, column)
+        return moved[id(token)]
+
+    lexed = [move(token) for token in lexed]
+    annotations = [
+        dict(
+            annot,
+            tok=move(annot["tok"]),
+            related_tokens=[move(tok) for tok in annot["related_tokens"]],
+        )
+        for annot in annotations
+    ]
+    return lexed, annotations
+
+
+def block_indentation(session, line: int) -> int | None:
+    """The indentation of the block scalar whose text starts at (line) of the
+    file being linted (counted from 0): that of its first line that is not
+    empty. None when we do not have the text of the file."""
+    source = session.source
+    if source is None:
+        return None
+    if session.source_starts is None:
+        session.source_starts = line_starts(source)
+    starts = session.source_starts
+    for i in range(line, len(starts)):
+        text = source[starts[i] : starts[i + 1] if i + 1 < len(starts) else None]
+        if text.strip():
+            return len(text) - len(text.lstrip(" "))
+    return None
+
+
+def classify_scalar(value: str, wrap_in_jinja_brackets: bool) -> str:
+    """Whether check_str() sees (value) as an "expression" (when:, until:, etc),
+    a "template", or "plain" text that Jinja2 would pass through untouched."""
+    if wrap_in_jinja_brackets:
+        return "expression"
+    if "{" in value and ("{{" in value or "{%" in value or "{#" in value):
+        return "template"
+    if "\r" in value:
+        return "template"  # the lexer rewrites newlines; analyze_scalar() copes
+    return "plain"
+
+
+def check_str(
+    session,
+    yaml_node,
+    pos_stack,
+    *,
+    wrap_in_jinja_brackets=False,
+    key: str | None = None,
+) -> bool:
+    """
+    wrap_in_jinja_brackets: force jinja to consider the payload an expression by wrapping in {{ }}
+
+    returns True on error, False on success"""
+    kind = classify_scalar(yaml_node.value, wrap_in_jinja_brackets)
+    session.stats[kind + " scalars"] += 1
+    profile = session.profile
+    if profile:
+        profile.counts["scalars"] += 1
+        started = time.perf_counter()
+    if kind == "plain":
+        return False  # a single data token: nothing to lint, nothing to display
+    if wrap_in_jinja_brackets:
+        s = "{{" + yaml_node.value + "}}"
+    else:
+        s = yaml_node.value
+
+    # where the text of the scalar starts, counted from 0:
+    file_line = yaml_node.start_mark.line
+    file_column = yaml_node.start_mark.column
+    if yaml_node.style in ("'", '"'):
+        file_column += 1  # after the quote
+    elif yaml_node.style in (">", "|"):
+        file_line += 1  # on the line after the indicator
+        indentation = block_indentation(session, file_line)
+        if indentation is not None:
+            file_column = indentation
+
+    # The tokens are needed to display the scalar, and for the register: checks
+    # unless it is a single name:
+    lex = bool(session.verbosity) or (
+        key == "register"
+        and bool(yaml_node.style or not yaml_node.value.strip().isidentifier())
+    )
+    memo_key = (s, yaml_node.style, wrap_in_jinja_brackets, session.local_names_key)
+    analysis = SCALAR_MEMO.get(memo_key)
+    if analysis is None or (lex and analysis.lexed is None):
+        session.stats["scalar memo misses"] += 1
+        analysis = analyze_scalar(
+            session, s, yaml_node.style, wrap_in_jinja_brackets, lex=lex
+        )
+        SCALAR_MEMO.put(memo_key, analysis)
+    else:
+        session.stats["scalar memo hits"] += 1
+    if analysis.resolved:
+        filename = pos_stack[0][2].rstrip(":")
+        external_variables = session.external_variables
+        external_variables[filename] = external_variables.get(filename, set())
+        external_variables[filename].update(analysis.resolved)
+    parse_e = relocate_error(analysis.parse_e, file_line, file_column)
+    lexer_e = relocate_error(analysis.lexer_e, file_line, file_column)
+    # The tokens stay where analyze_scalar() put them until we display them, so
+    # we report their positions relative to the scalar's:
+    lexed = analysis.lexed
+    annotations = list(analysis.annotations)
     if key == "register":
         if yaml_node.style:
             annotations.append(
                 {
+                    "rule": "register-quoted",
                     "comment": "register: variables should not be quoted but has: "
                     + repr(yaml_node.style),
                     "tok": (lexed and lexed[0])
-                    or {
-                        "lines": [
-                            # not sure how we get here, but we do when the scalar is "":
-                            {"line": file_line, "byteoff": 1, "text": "TODO"}
-                        ],
-                        "tag": "name",
-                    },
+                    # not sure how we get here, but we do when the scalar is "":
+                    or Token("name", "TODO", [0], 0, 4, dline=-1, dcol=-file_column),
                     "related_tokens": [],
                 }
             )
         seen_names = False
-        for token in lexed:
-            if token["tag"] == "whitespace":
+        for token in lexed or ():  # not lexed: a single name
+            if token.tag == "whitespace":
                 continue
-            if seen_names or token["tag"] != "name":
+            if seen_names or token.tag != "name":
                 annotations.append(
                     {
+                        "rule": "register-expression",
                         "comment": "register: should contain a single variable ('name' token)",
                         "tok": token,
                         "related_tokens": [],
                     }
                 )
                 break
-            seen_names |= token["tag"] == "name"
+            seen_names |= token.tag == "name"
 
-    print_lexed_debug(
-        lexed, node_path, parse_e, lexer_e, annotations=annotations, debug=False
-    )
+    filename = pos_stack[0][2].rstrip(":")
+    # most scalars have nothing to report, so the path is only built for the
+    # diagnostics and the views print_lexed_debug() does not skip:
+    node_path = ""
     if (
+        isinstance(parse_e, Exception)
+        or isinstance(lexer_e, Exception)
+        or annotations
+        or (session.out is not None and session.verbosity)
+    ):
+        node_path = get_node_path(pos_stack)
+    if profile:
+        profile.counts["annotations"] += len(annotations)
+    if isinstance(parse_e, Exception):
+        session.report(
+            Diagnostic(
+                filename,
+                parse_e.lineno,
+                None,
+                "jinja-syntax",
+                parse_e.message,
+                node_path=node_path,
+            )
+        )
+    if isinstance(lexer_e, Exception):
+        session.report(
+            Diagnostic(
+                filename,
+                lexer_e.lineno,
+                lexer_e.lex_col,
+                "jinja-lexer",
+                lexer_e.message,
+                node_path=node_path,
+            )
+        )
+    for annot in annotations:
+        related = []
+        for tok in annot["related_tokens"]:
+            line, byteoff = token_start(tok)
+            related.append((line + file_line, byteoff + file_column))
+        line, byteoff = token_start(annot["tok"])
+        session.report(
+            Diagnostic(
+                filename,
+                line + file_line,
+                byteoff + file_column,
+                annot["rule"],
+                annot["comment"],
+                tuple(related),
+                node_path,
+            )
+        )
+
+    show_debug_view = (
         annotations
-        or (verbosity >= 2 and len(lexed) > 1)
+        or (session.verbosity >= 2 and len(lexed) > 1)
         or not isinstance(parse_e, Target)
-    ):
-        output("\n" + "~" * OUT_COLS)  # separate the inline view from per-token listing
+    )
+    # nothing to display with -q, or when it was not even lexed:
+    if session.out is not None and lexed is not None:
+        if profile:
+            profile.enter("rendering")
+        lexed, annotations = relocate_tokens(lexed, annotations, file_line, file_column)
         print_lexed_debug(
-            lexed, node_path, parse_e, lexer_e, annotations=annotations, debug=True
+            session,
+            lexed,
+            node_path,
+            parse_e,
+            lexer_e,
+            annotations=annotations,
+            debug_view=bool(show_debug_view),
         )
+        if profile:
+            profile.leave()
+    if profile:
+        profile.scalar(time.perf_counter() - started, max(file_line, 0) + 1, pos_stack)
+    if show_debug_view:
         return FAIL_WHEN_ONLY_ANNOTATIONS
     return isinstance(parse_e, Exception) or isinstance(lexer_e, Exception)
 
 
-def check_shell_command(v, pos_stack) -> bool:
+def check_shell_command(session, v, pos_stack) -> bool:
     """Best-effort shell parsing.
 
     False: no error
     True: error
     """
     error = False
+    filename = pos_stack[0][2].rstrip(":")
     text = v.value
     s = shlex.shlex(text, posix=True, punctuation_chars=True)
     s.whitespace_split = True
     try:
         cmd = shlex.split(text)
     except ValueError:
-        output(Colored(HORIZONTAL_PIPE * OUT_COLS, "string"))
+        if session.out is not None:
+            session.output(Colored(HORIZONTAL_PIPE * session.columns, "string"))
         error = True
         cmd = None
         last_loc = (v.start_mark.line, 0)
@@ -943,36 +2350,73 @@ def check_shell_command(v, pos_stack) -> bool:
                 last_loc = this_loc
         except ValueError as e:
             lex_stop = s.instream.tell()
-            # www = text[: last_loc[1]].split("\n")
-            output(
-                Colored(text[: last_loc[1]], "variable_begin"),
-                Colored(text[last_loc[1] : lex_stop].rstrip(), "ERROR"),
-            )
-            output(
-                Colored("SHELL PARSING ERROR", "ERROR"),
-                f"{get_node_path(pos_stack)}:",
-                "line",
-                v.start_mark.line + s.lineno,
-                Colored(e, "ERROR"),
+            session.report(
+                Diagnostic(
+                    filename,
+                    v.start_mark.line + s.lineno,
+                    None,
+                    "shell-syntax",
+                    str(e),
+                    node_path=get_node_path(pos_stack),
+                )
             )
+            # www = text[: last_loc[1]].split("\n")
+            if session.out is not None:
+                session.output(
+                    Colored(text[: last_loc[1]], "variable_begin"),
+                    Colored(text[last_loc[1] : lex_stop].rstrip(), "ERROR"),
+                )
+                session.output(
+                    Colored("SHELL PARSING ERROR", "ERROR"),
+                    f"{get_node_path(pos_stack)}:",
+                    "line",
+                    v.start_mark.line + s.lineno,
+                    Colored(e, "ERROR"),
+                )
 
     # BELOW: Warn about things that bite:
     # Should really generalize the printing/annotation parts from the jinja parser with the shell parsing.
-    context = f"in {get_node_path(pos_stack)} line:{v.start_mark.line + 1}"
+    if session.out is not None:
+        context = f"in {get_node_path(pos_stack)} line:{v.start_mark.line + 1}"
     if cmd and "psql" in cmd:
         if "ON_ERROR_STOP=" not in text:
-            output(Colored(HORIZONTAL_PIPE * OUT_COLS, "string"))
-            output(
-                Colored("psql command without -v ON_ERROR_STOP=1", "comment"),
-                f"{context} - if this SQL command fails, it will still exit with exit code status zero (success) and Ansible will not detect the error. Also consider --single-transaction if you do not explicitly use transactions.",
+            session.report(
+                Diagnostic(
+                    filename,
+                    v.start_mark.line + 1,
+                    v.start_mark.column + 1,
+                    "psql-on-error-stop",
+                    "psql command without -v ON_ERROR_STOP=1",
+                    node_path=get_node_path(pos_stack),
+                )
             )
+            if session.out is not None:
+                session.output(Colored(HORIZONTAL_PIPE * session.columns, "string"))
+                session.output(
+                    Colored("psql command without -v ON_ERROR_STOP=1", "comment"),
+                    f"{context} - if this SQL command fails, it will still exit with exit code status zero (success) and Ansible will not detect the error. Also consider --single-transaction if you do not explicitly use transactions.",
+                )
             error = True
             return error
     if cmd and (
         ";}" in cmd or ";};" in cmd
     ):  # detects most common broken shell grouping
-        output(Colored(HORIZONTAL_PIPE * OUT_COLS, "string"))
-        output(Colored('WARNING: ";}" found, did you mean "; }" ?', "comment"), context)
+        session.report(
+            Diagnostic(
+                filename,
+                v.start_mark.line + 1,
+                v.start_mark.column + 1,
+                "shell-grouping",
+                '";}" found, did you mean "; }" ?',
+                node_path=get_node_path(pos_stack),
+            )
+        )
+        if session.out is not None:
+            session.output(Colored(HORIZONTAL_PIPE * session.columns, "string"))
+            session.output(
+                Colored('WARNING: ";}" found, did you mean "; }" ?', "comment"),
+                context,
+            )
 
     # TODO: return error
     # Commented out for now because we risk failing perfectly fine commands
@@ -986,19 +2430,40 @@ S_VAL = 20
 S_SEQ = 30
 
 
-def check_val(doc, pos_stack, error=False):
+def check_val(session, doc, pos_stack, error=False):
+    """Lints the YAML events from (doc) as they are parsed. Nothing is kept of an
+    event once it has been checked, apart from the state of the mappings and
+    sequences it is nested in and the anchors defined in the current document."""
     state = [(S_VAL, 0, set())]
     # list of tuples of state and data (used for list item counting). The set
     # keeps track of siblings keys to enable duplicate detection.
+    filename = pos_stack[0][2].rstrip(":")
+    anchors: dict[str, AnchorRecord] = {}  # defined so far in this document
+    aliased: set[str] = set()  # the anchors referred to so far in this document
     while True:
         try:
             v = next(doc)
         except StopIteration as e:
-            output(Colored("\n" + HORIZONTAL_PIPE * OUT_COLS, "ERROR"))
-            output(str(e))
-            output("Previous YAML token: ", Colored(repr(v), "data"))
-            output("YAML parser/lexer exit before end of document.")
-            output(Colored(HORIZONTAL_PIPE * OUT_COLS, "ERROR"))
+            mark = getattr(e.value, "mark", None)
+            session.report(
+                Diagnostic(
+                    filename,
+                    mark and mark.line + 1,
+                    mark and mark.column + 1,
+                    "yaml-syntax",
+                    getattr(e.value, "problem", None)
+                    or "YAML parser/lexer exit before end of document",
+                    node_path=get_node_path(pos_stack),
+                )
+            )
+            if session.out is not None:
+                session.output(
+                    Colored("\n" + HORIZONTAL_PIPE * session.columns, "ERROR")
+                )
+                session.output(str(e))
+                session.output("Previous YAML token: ", Colored(repr(v), "data"))
+                session.output("YAML parser/lexer exit before end of document.")
+                session.output(Colored(HORIZONTAL_PIPE * session.columns, "ERROR"))
             return True  # this is an error
 
         if getattr(v, "anchor", None) and not isinstance(
@@ -1006,30 +2471,43 @@ def check_val(doc, pos_stack, error=False):
         ):
             # https://www.educative.io/blog/advanced-yaml-syntax-cheatsheet#anchors
             # similar to HTML <a id="v.anchor">
-            ANCHORS[v.anchor] = v
+            anchors[v.anchor] = AnchorRecord(
+                v.anchor, filename, v.start_mark.line, v.start_mark.column
+            )
 
         if isinstance(v, ruamel.yaml.events.ScalarEvent):
             if S_KEY == state[-1][0]:
-                error |= check_str(v, pos_stack)
+                error |= check_str(session, v, pos_stack)
                 state[-1] = (S_VAL, v.value, *state[-1][2:])
                 # 'name', 'when', etc need special handling
                 # here we change the name of the parent mapping itself (starts out as empty):
                 if v.value in state[-1][2]:
-                    output(
-                        Colored("duplicate YAML key ", "ERROR")
-                        + v.value
-                        + Colored(pos_stack[-1][1], "ERROR")
+                    session.report(
+                        Diagnostic(
+                            filename,
+                            v.start_mark.line + 1,
+                            v.start_mark.column + 1,
+                            "duplicate-key",
+                            f"duplicate YAML key {v.value!r}",
+                            node_path=get_node_path(pos_stack),
+                        )
                     )
+                    if session.out is not None:
+                        session.output(
+                            Colored("duplicate YAML key ", "ERROR")
+                            + v.value
+                            + Colored(pos_stack[-1][1], "ERROR")
+                        )
                     error = True
                 state[-1][2].add(v.value)
                 pos_stack[-1] = (pos_stack[-1][0], pos_stack[-1][1], v.value)
             elif S_SEQ == state[-1][0]:
-                error |= check_str(v, pos_stack)
+                error |= check_str(session, v, pos_stack)
                 if len(state) >= 2 and state[-2][0] == S_KEY and state[-2][1] == "tags":
                     # tags: [ ..., v , ... ]: collect these for display
-                    filename = pos_stack[0][2].rstrip(":")
-                    SEEN_TAGS[filename] = SEEN_TAGS.get(filename, set())
-                    SEEN_TAGS[filename].add(v.value)
+                    seen_tags = session.seen_tags
+                    seen_tags[filename] = seen_tags.get(filename, set())
+                    seen_tags[filename].add(v.value)
                 next_idx = state[-1][1] + 1
                 state[-1] = (state[-1][0], next_idx)
                 pos_stack[-1] = (pos_stack[-1][0], pos_stack[-1][1], next_idx)
@@ -1037,41 +2515,43 @@ def check_val(doc, pos_stack, error=False):
                 key = state[-1][1]  #  the yaml key that this value resides under
                 if key == "tags":
                     # when it's a scalar value, it's split by comma
-                    filename = pos_stack[0][2].rstrip(":")
-                    SEEN_TAGS[filename] = SEEN_TAGS.get(filename, set())
-                    SEEN_TAGS[filename].update(
+                    seen_tags = session.seen_tags
+                    seen_tags[filename] = seen_tags.get(filename, set())
+                    seen_tags[filename].update(
                         map(lambda x: x.strip(), v.value.split(","))
                     )
                 elif key == "name":
-                    error |= check_str(v, pos_stack)
+                    error |= check_str(session, v, pos_stack)
                     # set context name of the parent node to the value of this:
                     if len(state) > 1 and state[-2][0] == S_SEQ:
                         pos_stack[-1] = (pos_stack[-1][0], pos_stack[-1][1], v.value)
                 elif key in ("when", "until"):
-                    error |= check_str(v, pos_stack, wrap_in_jinja_brackets=True)
+                    error |= check_str(
+                        session, v, pos_stack, wrap_in_jinja_brackets=True
+                    )
                 elif key in ("register",):
                     # Here we should (TODO):
                     # 1. mark this variable as a NON-EXTERNAL variable for the purposes
                     #    of tracking --external
                     # 2. Check that it's a single jinja "variable" token
                     error |= check_str(
-                        v, pos_stack, wrap_in_jinja_brackets=True, key=key
+                        session, v, pos_stack, wrap_in_jinja_brackets=True, key=key
                     )
                 elif key in (r"cmd", r"shell", r"ansible.builtin.shell"):
                     # Special casing for shell commands
                     # We should only do this within the 'shell' module, not the 'command' module.
-                    error |= check_str(v, pos_stack)
+                    error |= check_str(session, v, pos_stack)
                     # TODO should probably be careful about complaining about shell lexing errors if
                     # the string is subject to Jinja expansion.
-                    error |= check_shell_command(v, pos_stack)
+                    error |= check_shell_command(session, v, pos_stack)
                 elif key == "src":
                     # pos_stack[0][2]
                     # v.value is the path in a files/
                     # if the parent stack is "ansible.builtin.copy"
                     # TODO: breakpoint()
-                    error |= check_str(v, pos_stack)
+                    error |= check_str(session, v, pos_stack)
                 else:
-                    error |= check_str(v, pos_stack)
+                    error |= check_str(session, v, pos_stack)
                 if key in (r"meta", "ansible.builtin.meta"):
                     # meta: is special because the actual task depends on the value,
                     # so we rewrite it to contain the value:
@@ -1094,7 +2574,23 @@ def check_val(doc, pos_stack, error=False):
 
             if state and (key := state[-1][1]):
                 if key in ("register",):
-                    output(Colored(f"{key} cannot be a sequence/dict" + str(v.start_mark), "ERROR"))
+                    session.report(
+                        Diagnostic(
+                            filename,
+                            v.start_mark.line + 1,
+                            v.start_mark.column + 1,
+                            "register-not-scalar",
+                            f"{key} cannot be a sequence/dict",
+                            node_path=get_node_path(pos_stack),
+                        )
+                    )
+                    if session.out is not None:
+                        session.output(
+                            Colored(
+                                f"{key} cannot be a sequence/dict" + str(v.start_mark),
+                                "ERROR",
+                            )
+                        )
                     error = True
             # Open a new context for the contents of this mapping:
             if isinstance(v, ruamel.yaml.events.SequenceStartEvent):
@@ -1106,7 +2602,11 @@ def check_val(doc, pos_stack, error=False):
                 state.append((S_KEY, None, set()))
                 pos_stack.append((v.start_mark, v.end_mark, "MAP"))
         elif isinstance(v, ruamel.yaml.events.MappingEndEvent):
-            error |= lint_ansible_directives(v, state, pos_stack)
+            if session.profile:
+                session.profile.enter("lint_ansible_directives")
+            error |= lint_ansible_directives(session, v, state, pos_stack)
+            if session.profile:
+                session.profile.leave()
             state.pop()
             pos_stack.pop()
         elif isinstance(v, ruamel.yaml.events.SequenceEndEvent):
@@ -1114,7 +2614,8 @@ def check_val(doc, pos_stack, error=False):
             assert old[0] == S_SEQ
             pos_stack.pop()
         elif isinstance(v, ruamel.yaml.events.DocumentStartEvent):
-            pass
+            anchors.clear()  # aliases can only refer to anchors in the same document
+            aliased.clear()
         elif isinstance(v, ruamel.yaml.events.DocumentEndEvent):
             pass
         elif isinstance(v, ruamel.yaml.events.StreamStartEvent):
@@ -1124,19 +2625,71 @@ def check_val(doc, pos_stack, error=False):
         elif isinstance(v, ruamel.yaml.events.AliasEvent):
             # an AliasEvent is when something tries to include/refer to an "anchor",
             # similar to <a href="#anchor">
-            if v.anchor:
-                ALIASED_ANCHORS[v.anchor] = v
+            if v.anchor and v.anchor not in anchors:
+                error |= report_undefined_anchor(
+                    session, v, set(anchors).difference(aliased), pos_stack
+                )
+            aliased.add(v.anchor)
         else:
-            output(
+            session.output(
                 pos_stack, f"\nBUG: please report this! unhandled YAML type {repr(v)}"
             )  # , file=sys.stderr)
             error = True
     return error
 
 
-def lint_ansible_directives(v: ruamel.yaml.events.MappingEndEvent, state, pos_stack):
-    """Lints Ansible directives by looking at keys and values."""
-    filepath = pos_stack[0][2]
+def report_undefined_anchor(
+    session, v: ruamel.yaml.events.AliasEvent, unused: set[str], pos_stack
+) -> bool:
+    """Reports the alias (v) referring to an anchor that is not defined before it
+    in the same document, suggesting one of the (unused) anchors. Returns True."""
+    message = f"undefined anchor {v.anchor!r}"
+    if session.profile:
+        session.profile.counts["difflib calls"] += 1
+    suggested = difflib.get_close_matches(v.anchor, unused, 1, cutoff=0.20)
+    if suggested:
+        message += f", did you mean {suggested[0]!r}?"
+    session.report(
+        Diagnostic(
+            pos_stack[0][2].rstrip(":"),
+            v.start_mark.line + 1,
+            v.start_mark.column + 1,
+            "undefined-anchor",
+            message,
+            node_path=get_node_path(pos_stack),
+        )
+    )
+    if session.out is not None:
+        session.output(Colored(message + str(v.start_mark), "ERROR"))
+    return True
+
+
+def lint_ansible_directives(
+    session, v: ruamel.yaml.events.MappingEndEvent, state, pos_stack
+):
+    """Lints Ansible directives by looking at keys and values."""
+    filepath = pos_stack[0][2]
+
+    def warn(rule, message, keys, color="raw_begin"):
+        start = pos_stack[-1][0]
+        session.report(
+            Diagnostic(
+                filepath.rstrip(":"),
+                start.line + 1,
+                start.column + 1,
+                rule,
+                message,
+                node_path=get_node_path(pos_stack[:-1]),
+            )
+        )
+        if session.out is not None:
+            session.output(
+                Colored("WARNING: " + message, color),
+                keys,
+                f"at {get_node_path(pos_stack[:-1])} lines {start.line}-{v.end_mark.line}",
+            )
+        return True
+
     if ".github/workflows/" in filepath:
         return False  # skip github triggers
     if (
@@ -1167,56 +2720,34 @@ def lint_ansible_directives(v: ruamel.yaml.events.MappingEndEvent, state, pos_st
     if "async_status" in sibling_keys and not (
         "until" in sibling_keys or "register" in sibling_keys
     ):
-        output(
-            Colored("WARNING: 'async_status' without 'until'/'register'", "raw_begin"),
+        return warn(
+            "async-status-without-until",
+            "'async_status' without 'until'/'register'",
             sibling_keys,
-            f"at {get_node_path(pos_stack[:-1])} lines {pos_stack[-1][0].line}-{v.end_mark.line}",
         )
-        return True
 
     if "poll" in sibling_keys and "async" not in sibling_keys:
-        output(
-            Colored("WARNING: 'poll' without 'async'", "raw_begin"),
-            sibling_keys,
-            f"at {get_node_path(pos_stack[:-1])} lines {pos_stack[-1][0].line}-{v.end_mark.line}",
-        )
-        return True
+        return warn("poll-without-async", "'poll' without 'async'", sibling_keys)
 
     if "block" in sibling_keys:
         for loopd in sibling_keys:
             if loopd.startswith("with_") or loopd == "loop":
-                output(
-                    Colored(
-                        f"WARNING: '{loopd}' not allowed with 'block'", "raw_begin"
-                    ),
+                return warn(
+                    "loop-with-block",
+                    f"'{loopd}' not allowed with 'block'",
                     sibling_keys,
-                    f"at {get_node_path(pos_stack[:-1])} lines {pos_stack[-1][0].line}-{v.end_mark.line}",
                 )
-                return True
 
     if "ansible.builtin.meta:noop" in sibling_keys and "when" in sibling_keys:
-        output(
-            Colored("WARNING: 'when' not allowed with 'meta: noop'", "raw_begin"),
-            sibling_keys,
-            f"at {get_node_path(pos_stack[:-1])} lines {pos_stack[-1][0].line}-{v.end_mark.line}",
+        return warn(
+            "when-with-noop", "'when' not allowed with 'meta: noop'", sibling_keys
         )
-        return True
 
     if "rescue" in sibling_keys and "block" not in sibling_keys:
-        output(
-            Colored("WARNING: 'rescue' without 'block'", "raw_begin"),
-            sibling_keys,
-            f"at {get_node_path(pos_stack[:-1])} lines {pos_stack[-1][0].line}-{v.end_mark.line}",
-        )
-        return True
+        return warn("rescue-without-block", "'rescue' without 'block'", sibling_keys)
 
     if "always" in sibling_keys and "block" not in sibling_keys:
-        output(
-            Colored("WARNING: 'always' without 'block'", "raw_begin"),
-            sibling_keys,
-            f"at {get_node_path(pos_stack[:-1])} lines {pos_stack[-1][0].line}-{v.end_mark.line}",
-        )
-        return True
+        return warn("always-without-block", "'always' without 'block'", sibling_keys)
 
     if {
         "include_tasks",
@@ -1224,24 +2755,19 @@ def lint_ansible_directives(v: ruamel.yaml.events.MappingEndEvent, state, pos_st
     } & sibling_keys and {
         "notify",
     } & sibling_keys:
-        output(
-            Colored("WARNING: include_tasks: cannot notify:"),
+        return warn(
+            "include-tasks-notify",
+            "include_tasks: cannot notify:",
             sibling_keys,
-            f"at {get_node_path(pos_stack[:-1])} lines {pos_stack[-1][0].line}-{v.end_mark.line}",
+            color="RESET",
         )
-        return True
 
     if {
         "become_user",
         "become_method",
         "become_flags",
     } & sibling_keys and "become" not in sibling_keys:
-        output(
-            Colored("WARNING: expected 'become:' in this task", "raw_begin"),
-            sibling_keys,
-            f"at {get_node_path(pos_stack[:-1])} lines {pos_stack[-1][0].line}-{v.end_mark.line}",
-        )
-        return True
+        return warn("become-missing", "expected 'become:' in this task", sibling_keys)
 
     # TODO this list is probably not exhaustive:
     # TODO pull all the with_* from ansible/plugins/lookup/ etc
@@ -1322,12 +2848,7 @@ def lint_ansible_directives(v: ruamel.yaml.events.MappingEndEvent, state, pos_st
         diff.discard("always")
 
     if len(diff) > 1:
-        output(
-            Colored("WARNING: potentially conflicting modules:", "raw_begin"),
-            diff,
-            f"at {get_node_path(pos_stack[:-1])} lines {pos_stack[-1][0].line}-{v.end_mark.line}",
-        )
-        return True
+        return warn("conflicting-modules", "potentially conflicting modules:", diff)
 
     return False
 
@@ -1353,9 +2874,132 @@ def raw_scalar_generator(file_contents: str, file_name: Path):
     yield ruamel.yaml.events.StreamEndEvent()
 
 
-def ruamel_generator(filename):
-    try:
+def yaml_error(text: str, e: ruamel.yaml.error.MarkedYAMLError) -> Target:
+    """(text) describing the parser error (e), keeping what and where the problem
+    is for the diagnostic."""
+    err = Target(text)
+    err.problem = e.problem
+    err.mark = e.problem_mark
+    return err
+
+
+def ruamel_generator(filename, contents: str | None = None):
+    """YAML events of (filename), or of (contents) when given: from libyaml when it
+    is available and accepts the document, otherwise from ruamel's pure parser.
+    Documents with tabs go to ruamel directly: libyaml accepts tabs where ruamel
+    rejects them, e.g. after "key:", and ruamel decides what is an error."""
+    if contents is None:
         with open(filename) as fd:
+            contents = fd.read()
+    consumed = 0
+    if LIBYAML_PARSER is not None and "\t" not in contents:
+        for event in libyaml_events(filename, contents):
+            if event is None:
+                break
+            yield event
+            consumed += 1
+        else:
+            return
+    events = pure_ruamel_generator(filename, contents)
+    for _ in range(consumed):  # the same events, already checked
+        next(events, None)
+    return (yield from events)
+
+
+LINE_BREAK = re.compile(r"\r\n?|\n")
+# blanks, line breaks and comment lines, up to the next YAML token:
+BLANK_LINES = re.compile(r"[ \t]*(?:(?:#[^\r\n]*)?(?:\r\n?|\n)[ \t]*)*")
+
+
+def libyaml_events(filename, contents: str):
+    """Yields the events of (contents) parsed by libyaml, converted to the ruamel
+    events the pure parser would have produced, until None where the pure parser
+    must take over: libyaml rejected the document (ruamel explains errors better),
+    or there is a folded scalar (ruamel marks the folded line breaks, see
+    analyze_scalar(), libyaml only returns the folded text)."""
+    name = str(filename)  # ruamel names the file in its marks
+    # libyaml ends a document lacking a final line break on a line of its own:
+    last_line = len(LINE_BREAK.findall(contents))
+    last_column = len(contents) - max(contents.rfind("\n"), contents.rfind("\r")) - 1
+    nesting = []  # [flow_style, is_mapping, in_value] of the open collections
+
+    def mark(m):
+        if m.index == len(contents):
+            return ruamel.yaml.error.FileMark(name, m.index, last_line, last_column)
+        return ruamel.yaml.error.FileMark(name, m.index, m.line, m.column)
+
+    def empty_value_mark(m):
+        """ruamel puts an empty block mapping value where the next token starts,
+        libyaml right after the colon; both leave it there if a comment follows."""
+        gap = BLANK_LINES.match(contents, m.index).group()
+        if gap.lstrip(" \t").startswith("#"):
+            return mark(m)
+        breaks = list(LINE_BREAK.finditer(gap))
+        line, column = m.line + len(breaks), m.column + len(gap)
+        if breaks:
+            column = len(gap) - breaks[-1].end()
+        index = m.index + len(gap)
+        if index == len(contents):
+            line, column = last_line, last_column
+        return ruamel.yaml.error.FileMark(name, index, line, column)
+
+    def node_done():
+        if nesting and nesting[-1][1]:
+            nesting[-1][2] = not nesting[-1][2]
+
+    def tag(t):
+        return t and ruamel.yaml.tag.Tag(suffix=t)
+
+    parser = LIBYAML_PARSER(contents)
+    try:
+        while parser.check_event():
+            e = parser.get_event()
+            cls = getattr(ruamel.yaml.events, type(e).__name__)
+            start, end = mark(e.start_mark), mark(e.end_mark)
+            if isinstance(e, yaml.ScalarEvent):
+                if ">" == e.style:
+                    yield None
+                    return
+                if e.start_mark.index == e.end_mark.index and nesting:
+                    if nesting[-1][0]:
+                        yield None  # empty flow nodes; not worth mimicking
+                        return
+                    if nesting[-1][1] and nesting[-1][2]:
+                        start = end = empty_value_mark(e.start_mark)
+                event = cls(e.anchor, tag(e.tag), e.implicit, e.value, start, end)
+                event.style = e.style or None  # plain is "" in PyYAML
+                node_done()
+            elif isinstance(e, yaml.CollectionStartEvent):
+                event = cls(e.anchor, tag(e.tag), e.implicit, start, end)
+                event.flow_style = e.flow_style
+                nesting.append(
+                    [e.flow_style, isinstance(e, yaml.MappingStartEvent), False]
+                )
+            elif isinstance(e, yaml.CollectionEndEvent):
+                event = cls(start, end)
+                nesting.pop()
+                node_done()
+            elif isinstance(e, yaml.AliasEvent):
+                event = cls(e.anchor, start, end)
+                node_done()
+            elif isinstance(e, yaml.DocumentStartEvent):
+                event = cls(start, end, e.explicit, e.version, e.tags)
+            elif isinstance(e, yaml.DocumentEndEvent):
+                event = cls(start, end, e.explicit)
+            else:  # the stream start and end events
+                event = cls(start, end)
+            yield event
+    except yaml.YAMLError:
+        yield None
+    finally:
+        parser.dispose()
+
+
+def pure_ruamel_generator(filename, contents: str):
+    fd = io.StringIO(contents)
+    fd.name = str(filename)  # ruamel names the file in its marks
+    try:
+        with fd:
             yaml_obj = ruamel.yaml.YAML(typ=r"rt", pure=True)
             if ruamel.yaml.version_info[0:2] < (0, 15):
                 # backwards compatibility:
@@ -1375,7 +3019,7 @@ def ruamel_generator(filename):
                 err += (
                     f"\nThe dictionary entry{e.context_mark} appears to lack indenting."
                 )
-        return err
+        return yaml_error(err, e)
     except ruamel.yaml.parser.ParserError as e:
         err = str(e)
         if (
@@ -1388,46 +3032,859 @@ def ruamel_generator(filename):
                 err += "\nEither the line needs indentation or the key is missing?"
         # here we could look for next line that doesn't start with whitespace and restart
         # the parser?
-        return err  # this will raise a StopIteration exception in the consumer
+        # this will raise a StopIteration exception in the consumer:
+        return yaml_error(err, e)
+
+
+def lint(session, filename: Path, contents: str | bytes | None = None):
+    """Lints (filename). When (contents) is given it is linted instead of reading
+    the file, but (filename) is still used for reporting and to pick the parser."""
+    profile = session.profile
+    if profile:
+        profile.counts["files"] += 1
+    with profile.file(str(filename)) if profile else contextlib.nullcontext():
+        try:
+            if isinstance(contents, bytes):
+                contents = contents.decode()
+            discover_local_plugins(session, filename)
+            if contents is None:
+                contents = filename.read_text()
+            if is_yaml(filename):
+                session.source = contents
+                doc = ruamel_generator(filename, contents)
+                if profile:
+                    doc = profile.timed(doc, "ruamel_generator")
+            else:  # assume it's raw jinja2, mock up AST nodes:
+                doc = raw_scalar_generator(contents, filename)
+            return check_val(session, doc, pos_stack=[(0, 0, str(filename) + ":")])
+        except Exception as e:
+            session.report(
+                Diagnostic(
+                    str(filename),
+                    None,
+                    None,
+                    "internal-error",
+                    f"{type(e).__name__}: {e}",
+                )
+            )
+            if session.out is not None:
+                session.output(traceback.format_exc())
+            # that did not go well, perhaps file not found or yaml parsing err
+            return True
+        finally:
+            session.source = session.source_starts = None
+
 
+def is_yaml(path) -> bool:
+    """YAML by extension, or a file without one in group_vars/ or host_vars/,
+    where ansible reads those too (e.g. group_vars/all)."""
+    path = Path(path)
+    if path.suffix in (".yml", ".yaml"):
+        return True
+    return not path.suffix and bool(VARS_DIRS.intersection(path.parts[-3:-1]))
+
+
+VARS_DIRS = {"group_vars", "host_vars"}
+
+
+def is_lintable(path) -> bool:
+    """The files we know how to lint: YAML, and Jinja2 templates by extension or by
+    living in a templates/ directory (as in ansible roles)."""
+    path = Path(path)
+    return path.suffix == ".j2" or is_yaml(path) or "templates" in path.parts[:-1]
+
+
+def gitignore_pattern(pattern: str) -> tuple[re.Pattern, bool, bool] | None:
+    """Compiles a .gitignore (pattern) to (regex, negate, dir_only), with the regex
+    matching paths relative to the directory of the .gitignore. (negate) is set
+    for "!" patterns, (dir_only) for patterns that only match directories. None
+    for blank lines and comments."""
+    pattern = pattern.rstrip("\n")
+    if not pattern.strip() or pattern.startswith("#"):
+        return None
+    if not pattern.endswith("\\ "):
+        pattern = pattern.rstrip(" ")
+    negate = pattern.startswith("!")
+    pattern = pattern[negate or pattern.startswith("\\") :]
+    dir_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    # patterns with a slash are relative to the .gitignore, others match at any depth:
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+    regex, i = "", 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+            continue
+        if pattern.startswith("/**", i) and i + 3 == len(pattern):
+            regex += "/.*"
+            break
+        c = pattern[i]
+        if "*" == c:
+            regex += "[^/]*"
+        elif "?" == c:
+            regex += "[^/]"
+        elif "[" == c and (end := pattern.find("]", i + 2)) != -1:
+            chars = pattern[i + 1 : end]
+            if chars[0] in "!^":
+                chars = "^" + chars[1:]
+            regex += "[" + chars.replace("\\", "\\\\") + "]"
+            i = end
+        elif "\\" == c and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(c)
+        i += 1
+    if not anchored:
+        regex = "(?:.*/)?" + regex
+    return re.compile(regex), negate, dir_only
 
-def lint(filename: Path):
+
+def read_gitignore(path) -> list[tuple[re.Pattern, bool, bool]]:
     try:
-        if filename.suffix in (".yaml", ".yml"):
-            doc = ruamel_generator(filename)
-        else:  # assume it's raw jinja2, mock up AST nodes:
-            doc = raw_scalar_generator(filename.read_text(), filename)
-        return check_val(doc, pos_stack=[(0, 0, str(filename) + ":")])
-    except Exception:
-        output(traceback.format_exc())
-        return True  # that did not go well, perhaps file not found or yaml parsing err
+        with open(path) as fd:
+            return [pattern for line in fd if (pattern := gitignore_pattern(line))]
+    except OSError:
+        return []
 
 
-if "__main__" == __name__:
+def is_ignored(abspath: str, is_dir: bool, ignores) -> bool:
+    """Whether (abspath) is ignored by the (ignores), a list of (directory,
+    patterns) from the outermost directory in; the last matching pattern wins."""
+    ignored = False
+    for directory, patterns in ignores:
+        relpath = abspath[len(directory.rstrip("/")) + 1 :]
+        for regex, negate, dir_only in patterns:
+            if (is_dir or not dir_only) and regex.fullmatch(relpath):
+                ignored = not negate
+    return ignored
+
+
+# never descended into by walk_lintable(), in addition to virtualenvs:
+SKIPPED_DIRS = {".git", "collections", "ansible_collections", "node_modules", ".tox"}
+
+
+def walk_lintable(top: str, excludes=()):
+    """Yields the lintable files below the directory (top) as they are found, in
+    sorted order. .gitignore files are honored, in (top), in the directories
+    below it and in its parents up to the root of the git repository, and so
+    are the gitignore-style (excludes), relative to (top). SKIPPED_DIRS and
+    virtualenvs are not walked, nor are the files/ directories of roles, which
+    ansible copies without templating."""
+    abstop = os.path.abspath(top)
+    ignores = []
+    parents = [Path(abstop), *Path(abstop).parents]
+    root = next((parent for parent in parents if (parent / ".git").exists()), None)
+    if root is not None:
+        ignores.append((str(root), read_gitignore(root / ".git" / "info" / "exclude")))
+        for parent in reversed(parents[1 : parents.index(root) + 1]):
+            ignores.append((str(parent), read_gitignore(parent / ".gitignore")))
+    if excludes:
+        ignores.append((abstop, list(filter(None, map(gitignore_pattern, excludes)))))
+    yield from _walk_lintable(top, abstop, ignores)
+
+
+def _walk_lintable(path: str, abspath: str, ignores):
+    if patterns := read_gitignore(os.path.join(abspath, ".gitignore")):
+        ignores = [*ignores, (abspath, patterns)]
+    try:
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except OSError:
+        return
+    is_role = any(e.name == "tasks" and e.is_dir() for e in entries)
+    for entry in entries:
+        entry_abspath = os.path.join(abspath, entry.name)
+        if entry.is_dir(follow_symlinks=False):
+            if entry.name in SKIPPED_DIRS or (is_role and "files" == entry.name):
+                continue
+            if os.path.exists(os.path.join(entry.path, "pyvenv.cfg")):
+                continue  # virtualenv
+            if is_ignored(entry_abspath, True, ignores):
+                continue
+            yield from _walk_lintable(entry.path, entry_abspath, ignores)
+        elif (
+            entry.is_file()
+            and is_lintable(entry.path)
+            and not is_ignored(entry_abspath, False, ignores)
+        ):
+            yield Path(entry.path)
+
+
+class GitError(Exception):
+    pass
+
+
+def git(*args) -> bytes:
+    try:
+        proc = subprocess.run(
+            ["git", *args], input=b"", capture_output=True, check=True
+        )
+    except FileNotFoundError as e:
+        raise GitError(str(e)) from None
+    except subprocess.CalledProcessError as e:
+        raise GitError(e.stderr.decode(errors="replace").strip()) from None
+    return proc.stdout
+
+
+def git_cat_file(objects):
+    """Yields (object, contents) for each of the git (objects) (anything `git
+    rev-parse` understands, e.g. a blob id or HEAD:path), reading all of them
+    through a single `git cat-file --batch` process. Contents are None for missing
+    objects."""
+    proc = subprocess.Popen(
+        ["git", "cat-file", "--batch"], stdin=subprocess.PIPE, stdout=subprocess.PIPE
+    )
+    try:
+        for obj in objects:
+            # one at a time, so neither side can fill up a pipe and block:
+            proc.stdin.write(obj.encode() + b"\n")
+            proc.stdin.flush()
+            header = proc.stdout.readline().split()
+            if len(header) != 3:  # "<object> missing" / "ambiguous"
+                yield obj, None
+                continue
+            size = int(header[2])
+            contents = proc.stdout.read(size)
+            proc.stdout.read(1)  # the newline after the contents
+            yield obj, contents
+    finally:
+        proc.stdin.close()
+        proc.stdout.close()
+        proc.wait()
+
+
+def git_staged_files():
+    """Yields (path, blob id) for the staged YAML files and templates, with paths
+    relative to the current directory like the ones given on the command line."""
+    toplevel = git("rev-parse", "--show-toplevel").decode().rstrip("\n")
+    try:
+        head = git("rev-parse", "--verify", "--quiet", "HEAD").decode().strip()
+    except GitError:
+        # initial commit: diff against the empty tree instead
+        head = git("hash-object", "-t", "tree", "--stdin").decode().strip()
+    # "filter=ACMR": A)dded C)opied M)odified R)enamed, not D)eleted
+    raw = git(
+        "diff-index", "--cached", "--no-renames", "--diff-filter=ACMR", "-z", head, "--"
+    )
+    fields = raw.split(b"\0")
+    # each entry is ":<old mode> <new mode> <old blob> <new blob> <status>" NUL <path> NUL
+    for meta, path in zip(fields[0::2], fields[1::2]):
+        new_mode, new_blob = meta.split()[1], meta.split()[3]
+        if new_mode not in (b"100644", b"100755"):
+            continue  # symlinks, submodules
+        relpath = os.path.relpath(os.path.join(toplevel, os.fsdecode(path)))
+        if is_lintable(relpath):
+            yield Path(relpath), new_blob.decode()
+
+
+def git_staged_contents():
+    """Yields (path, contents) for the staged YAML files and templates."""
+    staged = list(git_staged_files())
+    blobs = git_cat_file(blob for _, blob in staged)
+    for (path, _), (_, contents) in zip(staged, blobs):
+        yield path, contents
+
+
+def git_changed_since(ref: str, paths=()):
+    """Returns ([path], [(path, blob id)]): the YAML files and templates in the work
+    tree that differ from (ref) or are untracked, and the ones that are the same as in (ref) along
+    with their blob ids there. Non-empty (paths) limit both to those files and
+    directories."""
+    toplevel = git("rev-parse", "--show-toplevel").decode().rstrip("\n")
+    pathspecs = [os.path.relpath(os.path.abspath(path), toplevel) for path in paths]
+
+    def relpath(path: bytes) -> str:
+        return os.path.relpath(os.path.join(toplevel, os.fsdecode(path)))
+
+    raw = git(
+        "-C",
+        toplevel,
+        "diff",
+        "--no-renames",
+        "--name-status",
+        "-z",
+        ref,
+        "--",
+        *pathspecs,
+    )
+    fields = raw.split(b"\0")
+    differs = set()
+    changed = []
+    # each entry is <status> NUL <path> NUL
+    for status, path in zip(fields[0::2], fields[1::2]):
+        differs.add(path)
+        if status != b"D" and is_lintable(relpath(path)):
+            if os.path.isfile(relpath(path)):  # not a submodule etc
+                changed.append(Path(relpath(path)))
+    # new files that are not added yet differ too, unless they are ignored:
+    raw = git(
+        "-C",
+        toplevel,
+        "ls-files",
+        "--others",
+        "--exclude-standard",
+        "-z",
+        "--",
+        *pathspecs,
+    )
+    for path in filter(None, raw.split(b"\0")):
+        if is_lintable(relpath(path)) and os.path.isfile(relpath(path)):
+            changed.append(Path(relpath(path)))
+    unchanged = []
+    raw = git("-C", toplevel, "ls-tree", "-r", "-z", ref, "--", *pathspecs)
+    # each entry is <mode> SP <type> SP <blob> TAB <path> NUL
+    for entry in filter(None, raw.split(b"\0")):
+        meta, path = entry.split(b"\t", 1)
+        mode, _, blob = meta.split()
+        if mode not in (b"100644", b"100755") or path in differs:
+            continue  # symlinks, submodules, changed files
+        if is_lintable(relpath(path)):
+            unchanged.append((Path(relpath(path)), blob.decode()))
+    return changed, unchanged
+
+
+def git_blobs(names):
+    """Yields (path, contents) for git object names such as HEAD:roles/x/tasks/main.yml
+    or :path (the staged version), reported under the path part of the name.
+    Contents are None for objects that do not exist."""
+    for name, contents in git_cat_file(names):
+        yield Path(name.split(":", 1)[-1] or name), contents
+
+
+def default_socket_path() -> str:
+    """Where --server listens; the client script computes the same path."""
+    if env := os.getenv("DANSABEL_SOCKET"):
+        return env
+    runtime_dir = os.getenv("XDG_RUNTIME_DIR")
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, "dansabel.sock")
+    return os.path.join(tempfile.gettempdir(), f"dansabel-{os.getuid()}.sock")
+
+
+class FrameWriter(io.TextIOBase):
+    """Text stream sending everything written to it to a client as (kind) frames:
+    one byte of (kind), four bytes of big-endian length, and the UTF-8 payload."""
+
+    def __init__(self, conn, kind: bytes):
+        self.conn = conn
+        self.kind = kind
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        if s:
+            payload = s.encode(errors="surrogateescape")
+            self.conn.sendall(self.kind + len(payload).to_bytes(4, "big") + payload)
+        return len(s)
+
+
+def serve(socket_path: str) -> int:
+    """Runs lint requests from jinjalint-client.py one at a time, reusing the
+    catalog and the jinja environment. A request is one line of JSON with the
+    client's argv, cwd, terminal settings and (for FILE "-") its stdin."""
+    global USE_COLORS, OUT_COLS
+    init_catalog()
+    if os.path.exists(socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+        except OSError:
+            os.unlink(socket_path)  # left behind by a server that died
+        else:
+            print(
+                f"dansabel: a server is already listening on {socket_path}",
+                file=sys.stderr,
+            )
+            return 1
+        finally:
+            probe.close()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)  # the socket lets others read files as us
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    server.listen()
+    print(f"dansabel: listening on {socket_path}", file=sys.stderr)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)  # clean up the socket
+    defaults = (USE_COLORS, OUT_COLS, os.getcwd())
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                try:
+                    with conn.makefile("rb") as rfile:
+                        request = json.loads(rfile.readline())
+                    USE_COLORS = request["tty"] and not request["no_color"]
+                    OUT_COLS = request["columns"] or 72
+                    os.chdir(request["cwd"])
+                    stdout = FrameWriter(conn, b"O")
+                    stderr = FrameWriter(conn, b"E")
+                    stdin = io.StringIO(request.get("stdin") or "")
+                    with (
+                        contextlib.redirect_stdout(stdout),
+                        contextlib.redirect_stderr(stderr),
+                    ):
+                        saved_stdin, sys.stdin = sys.stdin, stdin
+                        try:
+                            status = main(request["argv"])
+                        except SystemExit as e:  # argparse errors, --help
+                            status = e.code if isinstance(e.code, int) else 0
+                            if isinstance(e.code, str):
+                                print(e.code, file=sys.stderr)
+                                status = 1
+                        except Exception:
+                            traceback.print_exc()
+                            status = 1
+                        finally:
+                            sys.stdin = saved_stdin
+                    conn.sendall(b"X" + int(status).to_bytes(4, "big"))
+                except (OSError, ValueError, KeyError):
+                    pass  # client went away or sent garbage; keep serving others
+                finally:
+                    USE_COLORS, OUT_COLS = defaults[:2]
+                    os.chdir(defaults[2])
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        server.close()
+        os.unlink(socket_path)
+
+
+def lint_targets(args):
+    """Yields (path, contents) for each file to lint according to the command
+    line. Contents are None when lint() should read the file itself."""
+    if args.git_staged:
+        yield from git_staged_contents()
+    if args.git_blobs:
+        yield from git_blobs([str(name) for name in args.FILE])
+        return
+    for filename in args.FILE:
+        if "--" == filename:
+            continue
+        if Path("-") == filename:
+            yield args.stdin_filename, sys.stdin.read()
+            continue
+        if filename.is_dir():
+            for path in walk_lintable(str(filename), args.exclude):
+                yield path, None
+            continue
+        yield filename, None
+
+
+class ResultCache:
+    """On-disk cache of what linting a file produced: its output, diagnostics and
+    analysis results, keyed by a hash of the file contents and of everything else
+    the results depend on. Each entry is a JSON file written atomically, so
+    concurrent runs can share the cache. Hits touch the entry; prune() removes
+    the least recently used entries when the cache grows beyond (max_bytes)."""
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._environment = None
+
+    def environment(self) -> str:
+        """Hash of this linter's code, of the catalog key (ansible/jinja2 versions
+        and collections) and of the plugins in the user-wide plugin directories,
+        which all decide what a lint run reports."""
+        if self._environment is None:
+            init_catalog()
+            digest = hashlib.sha256(Path(__file__).read_bytes())
+            digest.update(json.dumps(CATALOG["key"], sort_keys=True).encode())
+            plugins = {}
+            for _, plugin_dir in user_plugin_dirs():
+                # adding, removing or editing a plugin changes these:
+                plugins[plugin_dir] = {
+                    f.name: f.stat().st_mtime_ns
+                    for f in sorted(Path(plugin_dir).glob("*.py"))
+                }
+            digest.update(json.dumps(plugins, sort_keys=True).encode())
+            self._environment = digest.hexdigest()
+        return self._environment
+
+    def key(self, session, filename: Path, contents: bytes) -> str:
+        # the path decides the parser and some checks, and it is in the output:
+        settings = [
+            self.environment(),
+            str(filename),
+            session.verbosity,
+            session.context_lines,
+            session.colors,
+            session.columns,
+            {kind: sorted(names) for kind, names in session.local_names.items()},
+        ]
+        digest = hashlib.sha256(json.dumps(settings).encode())
+        digest.update(contents)
+        return digest.hexdigest()
+
+    def blob_key(self, filename: Path, blob: str) -> str:
+        """Key for the analysis results of the git (blob) at (filename), which do
+        not depend on the output options."""
+        settings = [self.environment(), str(filename), blob]
+        return hashlib.sha256(json.dumps(settings).encode()).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.directory / key[:2] / (key[2:] + ".json")
+
+    def get(self, key: str) -> dict | None:
+        path = self.path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            os.utime(path)  # most recently used
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def put(self, key: str, entry: dict) -> None:
+        try:
+            write_json(entry, self.path(key))
+        except OSError:
+            pass  # read-only cache directory etc; we will lint the file next time
+
+    def prune(self) -> int:
+        """Removes the least recently used entries until the cache fits in
+        (max_bytes). Returns the number of entries removed."""
+        entries, total = [], 0
+        try:
+            for subdir in os.scandir(self.directory):
+                if not subdir.is_dir():
+                    continue
+                for entry in os.scandir(subdir.path):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue  # removed by a concurrent prune()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                    total += stat.st_size
+        except OSError:
+            return 0
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+
+def analysis_entry(session) -> dict:
+    """The analysis results (for --external and --tags) of linting one file in
+    (session), for ResultCache."""
+    return {
+        "external_variables": {
+            filename: sorted(names)
+            for filename, names in session.external_variables.items()
+        },
+        "seen_tags": {
+            filename: sorted(tags) for filename, tags in session.seen_tags.items()
+        },
+    }
+
+
+def cache_entry(error: bool, output: str, session) -> dict:
+    """What ResultCache keeps of linting one file in (session)."""
+    return {
+        "error": error,
+        "output": output,
+        "diagnostics": session.diagnostics,
+        **analysis_entry(session),
+    }
+
+
+def replay_cache_entry(session, entry: dict) -> bool:
+    """Adds what the cached (entry) found to (session), as if the file had been
+    linted again. Returns the error status."""
+    if session.out is not None:
+        session.out.write(entry["output"])
+    for fields in entry["diagnostics"]:
+        diagnostic = Diagnostic(*fields)
+        session.report(
+            diagnostic._replace(related=tuple(map(tuple, diagnostic.related)))
+        )
+    replay_analysis_entry(session, entry)
+    return entry["error"]
+
+
+def replay_analysis_entry(session, entry: dict) -> None:
+    """Adds the analysis results in the cached (entry) to (session)."""
+    for filename, names in entry["external_variables"].items():
+        session.external_variables.setdefault(filename, set()).update(names)
+    for filename, tags in entry["seen_tags"].items():
+        session.seen_tags.setdefault(filename, set()).update(tags)
+
+
+def lint_cached(session, filename: Path, contents: str | bytes | None = None) -> bool:
+    """lint() through the session's ResultCache, if it has one."""
+    if session.cache is None:
+        return lint(session, filename, contents)
+    if contents is None:
+        try:
+            contents = filename.read_bytes()
+        except OSError:
+            return lint(session, filename)  # reports the error
+    elif isinstance(contents, str):
+        contents = contents.encode()
+    discover_local_plugins(session, filename)
+    key = session.cache.key(session, filename, contents)
+    entry = session.cache.get(key)
+    if entry is not None:
+        session.stats["cache hits"] += 1
+        return replay_cache_entry(session, entry)
+    session.stats["cache misses"] += 1
+    # lint in a session of its own to find out what this file contributes:
+    file_session = LintSession(out=io.StringIO(), **session.options)
+    file_session.local_names = session.local_names
+    file_session.local_plugin_dirs = session.local_plugin_dirs
+    file_session.local_names_key = session.local_names_key
+    error = lint(file_session, filename, contents)
+    file_session.flush()
+    # the scalars parsed, the memo lookups, and the time it took:
+    session.stats.update(file_session.stats)
+    if session.profile is not None:
+        session.profile.merge(file_session.profile)
+    entry = cache_entry(error, file_session.out.getvalue(), file_session)
+    session.cache.put(key, entry)
+    return replay_cache_entry(session, entry)
+
+
+def analyze_unchanged(session, cache: ResultCache | None, unchanged) -> None:
+    """Adds the analysis results of the (path, blob id) pairs from
+    git_changed_since() that --since does not lint to (session), from the (cache)
+    when they were analyzed before. Without a cache they are analyzed every time."""
+    for filename, blob in unchanged:
+        key = cache and cache.blob_key(filename, blob)
+        entry = cache and cache.get(key)
+        if entry is None:
+            session.stats["unchanged misses"] += 1
+            file_session = LintSession(profile=session.profile)  # not reported
+            file_session.local_names = session.local_names
+            file_session.local_plugin_dirs = session.local_plugin_dirs
+            file_session.local_names_key = session.local_names_key
+            lint(file_session, filename)
+            session.local_names_key = file_session.local_names_key
+            session.stats.update(file_session.stats)
+            entry = analysis_entry(file_session)
+            if cache is not None:
+                cache.put(key, entry)
+        else:
+            session.stats["unchanged hits"] += 1
+        replay_analysis_entry(session, entry)
+
+
+def lint_job(session, job) -> bool:
+    """Lints one (path, contents, from_git) entry from lint_targets()."""
+    filename, contents, from_git = job
+    if contents is None and from_git:
+        session.report(
+            Diagnostic(
+                str(filename), None, None, "git-object-missing", "not found in git"
+            )
+        )
+        session.output(Colored(f"{filename}: not found in git", "ERROR"))
+        session.flush()
+        return True
+    error = lint_cached(session, filename, contents)
+    session.flush()  # the report for the file in one write
+    return error
+
+
+def lint_job_buffered(options: dict, buffered: bool, job):
+    """lint_job() in a --jobs worker process, in a session of its own: returns
+    the error status, the output, and the session, for the parent to print and
+    merge in input order."""
+    session = LintSession(out=io.StringIO() if buffered else None, **options)
+    if session.profile is not None:  # one (options) is unpickled per chunk of jobs
+        session.profile = Profile(session.profile.top)
+    error = lint_job(session, job)
+    text = session.out.getvalue() if buffered else ""
+    session.out = None  # not picklable
+    return error, text, session
+
+
+def lint_parallel(session, jobs, processes: int, done=None) -> bool:
+    """Lints (jobs) in (processes) forked workers. The workers share the
+    already loaded catalog; their output is printed in the order of (jobs),
+    so it reads the same as a serial run. (done)() is called after each file."""
+    error = False
+    init_catalog()
+    worker = functools.partial(
+        lint_job_buffered, session.options, session.out is not None
+    )
+    with multiprocessing.get_context("fork").Pool(
+        processes,
+        # under --server SIGTERM raises KeyboardInterrupt; the pool uses it to stop workers:
+        initializer=signal.signal,
+        initargs=(signal.SIGTERM, signal.SIG_DFL),
+    ) as pool:
+        for file_error, text, file_session in pool.imap(worker, jobs, chunksize=4):
+            error |= file_error
+            if session.out is not None:
+                session.out.write(text)
+            session.merge(file_session)
+            if done:
+                done()
+    return error
+
+
+def diagnostic_record(diagnostic: Diagnostic) -> dict:
+    """(diagnostic) for --format json and ndjson."""
+    return {
+        "file": diagnostic.file,
+        "line": diagnostic.line,
+        "column": diagnostic.column,
+        "rule": diagnostic.rule,
+        "message": diagnostic.message,
+        "related": [
+            {"line": line, "column": column} for line, column in diagnostic.related
+        ],
+        "node_path": diagnostic.node_path,
+    }
+
+
+def sarif_location(file: str, line, column, node_path: str = "") -> dict:
+    location = {
+        "physicalLocation": {"artifactLocation": {"uri": Path(file).as_posix()}}
+    }
+    if line and line > 0:
+        region = location["physicalLocation"]["region"] = {"startLine": line}
+        if column and column > 0:
+            region["startColumn"] = column
+    if node_path:
+        location["logicalLocations"] = [{"fullyQualifiedName": node_path}]
+    return location
+
+
+def sarif_log(diagnostics, properties: dict) -> dict:
+    """A SARIF 2.1.0 log of (diagnostics) for --format sarif; (properties) are
+    the --external/--tags results."""
+    results = []
+    for diagnostic in diagnostics:
+        result = {
+            "ruleId": diagnostic.rule,
+            "level": "error",
+            "message": {"text": diagnostic.message},
+            "locations": [
+                sarif_location(
+                    diagnostic.file,
+                    diagnostic.line,
+                    diagnostic.column,
+                    diagnostic.node_path,
+                )
+            ],
+        }
+        if diagnostic.related:
+            result["relatedLocations"] = [
+                dict(id=i, **sarif_location(diagnostic.file, line, column))
+                for i, (line, column) in enumerate(diagnostic.related)
+            ]
+        results.append(result)
+    run = {
+        "tool": {
+            "driver": {
+                "name": "dansabel",
+                "informationUri": "https://github.com/semaphor-dk/dansabel",
+                "rules": [
+                    {"id": rule} for rule in sorted({d.rule for d in diagnostics})
+                ],
+            }
+        },
+        "results": results,
+    }
+    if properties:
+        run["properties"] = properties
+    return {
+        "$schema": "https://json.schemastore.org/sarif-2.1.0.json",
+        "version": "2.1.0",
+        "runs": [run],
+    }
+
+
+def non_negative_int(text: str) -> int:
+    """argparse type for the sizes that can be 0 but not negative."""
+    value = int(text)
+    if value < 0:
+        raise argparse.ArgumentTypeError(f"must be 0 or more: {value}")
+    return value
+
+
+def main(argv=None) -> int:
+    """Command line entry point; returns the exit status."""
+    global CATALOG_VERBOSE
     a_parser = argparse.ArgumentParser(
+        prog="jinjalint.py",
         formatter_class=argparse.RawDescriptionHelpFormatter,
         description="Lints each of the provided FILE(s) for jinja2/yaml errors.",
         epilog="""EXAMPLES
 
+  Lint the YAML files and templates in the current directory and below:
+  jinjalint.py .
+
   List external variables used from Jinja:
   jinjalint.py -q --external ./*.j2 ./*.yml
 
   List tags encountered in YAML files:
   jinjalint.py -q --tags testcases/good/*.yml
 
+  Keep a server running to make repeated runs (e.g. from an editor) fast:
+  jinjalint.py --server &
+  jinjalint-client.py ./*.yml
+
+  Lint the files staged for commit, as they are in the index:
+  jinjalint.py --git-staged
+
   Set environment variable NO_COLOR to disable colored output.
 """,
     )
-    a_parser.add_argument("FILE", nargs="+", type=Path)
+    a_parser.add_argument(
+        "FILE",
+        nargs="*",
+        type=Path,
+        help=""""-" reads the file from standard input. Directories are searched
+for YAML files and templates, skipping what .gitignore ignores.""",
+    )
+    a_parser.add_argument(
+        "--exclude",
+        action="append",
+        default=[],
+        metavar="PATTERN",
+        help="""Skip the files and directories matching the gitignore-style PATTERN
+when searching directories. Can be given multiple times.""",
+    )
     a_parser.add_argument(
         "-C",
         "--context-lines",
         type=int,
-        help="Number of context lines controls LAST_THRESHOLD",
+        help="Number of context lines shown around problems",
     )
     a_parser.add_argument(
         "-q", "--quiet", action="store_true", help="No normal output to stdout"
     )
+    a_parser.add_argument(
+        "--format",
+        choices=("text", "json", "ndjson", "sarif"),
+        default="text",
+        help="""Print the diagnostics as a JSON list, as one JSON object per line
+(written as soon as each file is linted), or as a SARIF log, instead of the
+normal output (default: %(default)s)""",
+    )
+    a_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="""Lint with JOBS worker processes, 0 for one per CPU.
+The output is printed in the same order as with a single job.""",
+    )
     a_parser.add_argument(
         "-v",
         "--verbose",
@@ -1436,6 +3893,98 @@ if "__main__" == __name__:
 -v prints all Jinja snippets, regardless of errors. -vv prints full AST for each Jinja node.""",
         default=0,
     )
+    a_parser.add_argument(
+        "--stdin-filename",
+        type=Path,
+        default=Path("stdin.yml"),
+        help='Name used for FILE "-" in the output; its suffix selects YAML or raw Jinja2.',
+    )
+    a_parser.add_argument(
+        "--git-staged",
+        action="store_true",
+        help="""Lint the YAML files and templates staged for commit. Their staged
+contents are read from git, so unstaged changes in the work tree are ignored.""",
+    )
+    a_parser.add_argument(
+        "--git-blobs",
+        action="store_true",
+        help="""Each FILE is a git object name such as HEAD:roles/x/tasks/main.yml,
+or :path for the staged version; its contents are read from git.""",
+    )
+    a_parser.add_argument(
+        "--since",
+        metavar="REF",
+        help="""Lint only the YAML files and templates that differ from the git REF,
+within FILE if given, and the untracked ones. --external and --tags still cover all the files;
+with --cache, the results for the unchanged ones are kept in the cache directory
+(they are analyzed once per version of the file).""",
+    )
+    a_parser.add_argument(
+        "--rebuild-catalog",
+        action="store_true",
+        help=f"""Rebuild the cached catalog of known Ansible filters and tests
+({catalog_path()}). This happens automatically when the installed
+ansible-core/ansible/jinja2 versions or collections change.""",
+    )
+    a_parser.add_argument(
+        "--cache",
+        action="store_true",
+        help=f"""Reuse the results for files that have not changed since they were
+last linted with the same options, from a cache in {catalog_path().parent / "results"}""",
+    )
+    a_parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        help="Use this directory for --cache (implies --cache)",
+    )
+    a_parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=200,
+        metavar="MB",
+        help="""Remove the least recently used results when the cache grows beyond
+this size (default: %(default)s)""",
+    )
+    a_parser.add_argument(
+        "--cache-stats",
+        action="store_true",
+        help="""Print the number of hits, misses and evictions of --cache, how many
+scalars needed parsing, and how well --memo-size works, to stderr""",
+    )
+    a_parser.add_argument(
+        "--memo-size",
+        type=non_negative_int,
+        default=SCALAR_MEMO.maxsize,
+        metavar="N",
+        help="""Remember the results of checking up to N distinct Jinja2 strings, to
+reuse them when the same string appears again; 0 disables this (default: %(default)s)""",
+    )
+    a_parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="""Print the wall and CPU time spent in each stage of linting (YAML
+parsing, Jinja2 parsing and lexing, the checks, rendering the report, loading
+ansible plugins), counts of scalars and tokens, and the slowest files and
+scalars, to stderr""",
+    )
+    a_parser.add_argument(
+        "--profile-top",
+        type=int,
+        default=10,
+        metavar="N",
+        help="Number of the slowest files and scalars --profile lists (default: %(default)s)",
+    )
+    a_parser.add_argument(
+        "--server",
+        action="store_true",
+        help="""Serve lint requests from jinjalint-client.py on a unix socket,
+keeping the catalog loaded between requests.""",
+    )
+    a_parser.add_argument(
+        "--socket",
+        default=default_socket_path(),
+        help="Socket path for --server (default: %(default)s)",
+    )
     group_analysis = a_parser.add_argument_group(
         "Analysis options",
         description="""Dumps a JSON dictionary with the results of various analysis steps.
@@ -1452,24 +4001,67 @@ Use -q to print ONLY this JSON summary.""",
         "-t", "--tags", action="store_true", help="""List encountered tags."""
     )
 
-    args = a_parser.parse_args()
+    args = a_parser.parse_args(argv)
+    CATALOG_VERBOSE = args.verbose > 0
+    if args.server:
+        return serve(args.socket)
+    if args.rebuild_catalog:
+        init_catalog(rebuild=True)
+    elif not args.FILE and not args.git_staged and not args.since:
+        a_parser.error("the following arguments are required: FILE")
 
-    if args.quiet:
-
-        def output(*_, **__):
-            return
+    SCALAR_MEMO.maxsize = args.memo_size
+    results = ResultCache(
+        args.cache_dir or catalog_path().parent / "results",
+        args.cache_size * 1024 * 1024,
+    )
+    session = LintSession(
+        out=None if args.quiet or args.format != "text" else sys.stdout,
+        verbosity=args.verbose,
+        context_lines=args.context_lines or 3,
+        colors=USE_COLORS,
+        columns=OUT_COLS,
+        cache=results if args.cache or args.cache_dir else None,
+        profile=Profile(args.profile_top) if args.profile else None,
+    )
+    if session.profile:
+        with session.profile.file("(start-up)"):
+            init_catalog()  # rather than in the first file, or outside --jobs workers
+    processes = args.jobs or os.cpu_count() or 1
+    if "fork" not in multiprocessing.get_all_start_methods():
+        processes = 1  # workers have to inherit the catalog and settings
+    emitted = 0  # the diagnostics already printed by --format ndjson
 
-    if args.context_lines:
-        LAST_THRESHOLD = args.context_lines
-    if args.verbose:
-        verbosity = args.verbose
+    def file_done():
+        nonlocal emitted
+        if args.format == "ndjson":
+            for diagnostic in session.diagnostics[emitted:]:
+                print(json.dumps(diagnostic_record(diagnostic)))
+            emitted = len(session.diagnostics)
+            sys.stdout.flush()
 
     error = False
-    # we do not support any flags, so for now we just:
-    for filename in args.FILE:
-        if "--" == filename:
-            continue
-        error |= lint(filename)
+    try:
+        unchanged = []
+        if args.since:
+            changed, unchanged = git_changed_since(args.since, args.FILE)
+            jobs = ((filename, None, False) for filename in changed)
+        else:
+            jobs = (
+                (filename, contents, args.git_blobs)
+                for filename, contents in lint_targets(args)
+            )
+        if processes > 1:
+            error = lint_parallel(session, jobs, processes, file_done)
+        else:
+            for job in jobs:
+                error |= lint_job(session, job)
+                file_done()
+        if args.external or args.tags:  # the only results the unchanged files add
+            analyze_unchanged(session, session.cache, unchanged)
+    except GitError as e:
+        print(f"jinjalint.py: git: {e}", file=sys.stderr)
+        return 2
 
     class SetEncoder(json.JSONEncoder):
         """https://stackoverflow.com/a/8230505"""
@@ -1482,38 +4074,82 @@ Use -q to print ONLY this JSON summary.""",
     json_dump = {}
     if args.external:
         # TODO should this really be print() ?
-        json_dump["external_variables"] = EXTERNAL_VARIABLES
+        json_dump["external_variables"] = session.external_variables
     if args.tags:
-        json_dump["files_to_tags"] = SEEN_TAGS
+        json_dump["files_to_tags"] = session.seen_tags
         tags_to_files: dict[str, set[str]] = dict()
-        for fn, tags in SEEN_TAGS.items():
+        for fn, tags in session.seen_tags.items():
             for tag in tags:
                 tags_to_files[tag] = tags_to_files.get(tag, set())
                 tags_to_files[tag].add(fn)
         json_dump["tags_to_files"] = tags_to_files
-    if args.tags or args.external:
+    if (args.tags or args.external) and args.format == "text":
         print(json.dumps(json_dump, cls=SetEncoder, indent=2))
 
-    missing_anchors = set(ALIASED_ANCHORS).difference(set(ANCHORS))
-    if missing_anchors:
-        # ALIASED_ANCHORS contains something not in ANCHORS, which means we are referring to
-        # an anchor that doesn't exist.
-        # TODO: this heuristic will let some problems fall through the cracks because we do not
-        # track scoping of aliases/anchors like Ansible would, but at least we can catch
-        # misspelled anchors. :-)
-        error = True
-        unused_anchors = set(ANCHORS).difference(set(ALIASED_ANCHORS))
-        output(Colored("undefined anchors attempted aliased:", "ERROR"))
-        for m in missing_anchors:
-            suggested = difflib.get_close_matches(m, unused_anchors, 1, cutoff=0.20)
-            output(
-                Colored("- " + repr(m) + str(ALIASED_ANCHORS[m].start_mark), "ERROR"),
-                end="",
+    if args.format == "ndjson":
+        if json_dump:
+            print(json.dumps(json_dump, cls=SetEncoder))
+    elif args.format == "json":
+        records = list(map(diagnostic_record, session.diagnostics))
+        print(
+            json.dumps({"diagnostics": records, **json_dump}, cls=SetEncoder, indent=2)
+        )
+    elif args.format == "sarif":
+        sarif = sarif_log(session.diagnostics, json_dump)
+        print(json.dumps(sarif, cls=SetEncoder, indent=2))
+    stats = session.stats
+    if session.cache is not None and (
+        stats["cache misses"] or stats["unchanged misses"]
+    ):
+        stats["cache evictions"] = results.prune()
+    if args.cache_stats:
+        if session.cache is not None:
+            print(
+                "jinjalint.py: cache: {} hits, {} misses, {} evictions".format(
+                    stats["cache hits"],
+                    stats["cache misses"],
+                    stats["cache evictions"],
+                ),
+                file=sys.stderr,
             )
-            if suggested:
-                output(
-                    Colored(" - did you mean " + repr(suggested[0]), "ERROR"), end=""
-                )
-            output()
+        if args.since:
+            print(
+                "jinjalint.py: --since: {} unchanged files, {} analyzed".format(
+                    stats["unchanged hits"] + stats["unchanged misses"],
+                    stats["unchanged misses"],
+                ),
+                file=sys.stderr,
+            )
+        print(
+            "jinjalint.py: scalars: {} plain (not parsed), {} expressions, {} templates;".format(
+                stats["plain scalars"],
+                stats["expression scalars"],
+                stats["template scalars"],
+            ),
+            "{} of {} parsed also lexed".format(
+                stats["lexed scalars"], stats["parsed scalars"]
+            ),
+            file=sys.stderr,
+        )
+        lookups = stats["scalar memo hits"] + stats["scalar memo misses"]
+        print(
+            "jinjalint.py: scalar memo: {} hits ({:.0%}), {} misses,".format(
+                stats["scalar memo hits"],
+                stats["scalar memo hits"] / (lookups or 1),
+                stats["scalar memo misses"],
+            ),
+            "{} of {} entries using {} KiB{}".format(
+                len(SCALAR_MEMO.entries),
+                SCALAR_MEMO.maxsize,
+                SCALAR_MEMO.nbytes >> 10,
+                " in the main process" if processes > 1 else "",
+            ),
+            file=sys.stderr,
+        )
+    if session.profile:
+        session.profile.print_summary(sys.stderr)
+    return int(error)
 
-    sys.exit(error)
+
+if "__main__" == __name__:
+    sys.exit(main())
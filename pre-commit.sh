@@ -98,16 +98,14 @@ do
 		 || fejl
 	     ;;&
 
-	 *roles/*/templates/* ) # try to match raw templates in addition to .j2:
-	     ! [[ "$(dirname "${origfullname}")" =~ templates$
-		]] && break ;&
-	 *.yml) ;&
-         *.j2)
-
-	     "$(dirname "$0")"/jinjalint.py -- "$blobpath" \
-		 || fejl
-	     ;;&
-
     esac
 done
 
+# jinjalint reads the staged YAML files and templates straight from the index
+# itself, all of them in one go (uses a running "jinjalint.py --server" if there is one):
+printf '\e[31;1m'
+"$(dirname "$0")"/jinjalint-client.py --git-staged || {
+    echo $'\x1b[31;1m'"rejected by pre-commit.sh: jinjalint.py --git-staged"$'\x1b[0m'
+    exit 1
+}
+
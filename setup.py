@@ -22,6 +22,6 @@ setup(
     include_package_data=True,
     long_description=open("README.md").read(),
     classifiers=["License :: OSI Approved :: ISC license"],
-    scripts=["jinjalint.py"],
+    scripts=["jinjalint.py", "jinjalint-client.py"],
     data_files=[],
 )
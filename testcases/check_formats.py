@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""Checks that each --format on testcases/bad exits nonzero with valid JSON that
+has at least one result for every file. Prints OK or FAIL lines like make test.
+
+    testcases/check_formats.py [FORMAT ...]
+"""
+
+import glob
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def results_files(fmt: str, stdout: str) -> set:
+    """The files that (stdout) of --format (fmt) has results for."""
+    if fmt == "ndjson":
+        return {json.loads(line).get("file") for line in stdout.splitlines()}
+    if fmt == "sarif":
+        return {
+            result["locations"][0]["physicalLocation"]["artifactLocation"]["uri"]
+            for result in json.loads(stdout)["runs"][0]["results"]
+        }
+    return {record["file"] for record in json.loads(stdout)["diagnostics"]}
+
+
+def check(fmt: str) -> bool:
+    run = subprocess.run(
+        ["./jinjalint.py", "--format", fmt, "testcases/bad"],
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+    )
+    try:
+        found = results_files(fmt, run.stdout)
+    except (ValueError, KeyError, IndexError) as e:
+        print(f"FAIL --format {fmt}: {e!r}")
+        return False
+    files = set()
+    for pattern in ("testcases/bad/**/*.yml", "testcases/bad/**/*.j2"):
+        files.update(glob.glob(pattern, root_dir=ROOT, recursive=True))
+    for path in sorted(files - found):
+        print(f"FAIL --format {fmt} {path}: no results")
+    if not run.returncode:
+        print(f"FAIL --format {fmt}: exit status 0")
+    if run.returncode and files <= found:
+        print(f"OK --format {fmt}")
+        return True
+    return False
+
+
+if "__main__" == __name__:
+    formats = sys.argv[1:] or ["json", "ndjson", "sarif"]
+    sys.exit(int(not all([check(fmt) for fmt in formats])))
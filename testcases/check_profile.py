@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""Checks that --profile counts the same with --jobs 4 as with --jobs 1 on the
+testcases. Prints OK or FAIL lines like make test.
+
+Only the counts that do not depend on the per-process memos are compared: each
+worker has its own, so how often "jinja parse", "ansible imports" and difflib
+run depends on how the files are split between the workers.
+
+    testcases/check_profile.py [JOBS]
+"""
+
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+COUNTS = ("files", "scalars", "annotations")
+STAGES = ("check_val", "ruamel_generator", "lint_ansible_directives")
+
+
+def profile_counts(jobs: int) -> dict:
+    """The counts and stage calls --profile prints for the testcases."""
+    run = subprocess.run(
+        ["./jinjalint.py", "-q", "--profile", "--jobs", str(jobs), "testcases"],
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+    )
+    counts = {}
+    for line in run.stderr.splitlines():
+        fields = line.split()
+        if fields and fields[0] in STAGES:
+            counts[fields[0]] = int(fields[3])  # stage, wall s, cpu s, calls
+        for number, name in re.findall(r"(\d+) (\w+)", line):
+            if name in COUNTS and line.startswith("jinjalint.py: profile: "):
+                counts[name] = int(number)
+    return counts
+
+
+if "__main__" == __name__:
+    jobs = int(sys.argv[1]) if sys.argv[1:] else 4
+    serial, parallel = profile_counts(1), profile_counts(jobs)
+    if serial and serial == parallel:
+        print(f"OK --profile --jobs {jobs}")
+        sys.exit(0)
+    for name in sorted(set(serial) | set(parallel)):
+        if serial.get(name) != parallel.get(name):
+            print(
+                f"FAIL --profile --jobs {jobs}: {name} {serial.get(name)} with"
+                f" --jobs 1, {parallel.get(name)} with --jobs {jobs}"
+            )
+    if not serial:
+        print(f"FAIL --profile --jobs {jobs}: no counts")
+    sys.exit(1)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""Checks that the suggestions for misspelled filters, tests and distributions
+are the ones difflib.get_close_matches() would give: suggest() and
+DISTRIBUTIONS only skip the candidates that cannot make the cut. Prints OK or
+FAIL lines like make test.
+
+    testcases/check_suggestions.py [--seed N] [--names N]
+"""
+
+import argparse
+import difflib
+import os
+import random
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+import jinjalint  # noqa: E402
+
+# the local filter of testcases/good/filter_plugins, for suggest(local_names=...):
+LOCAL_NAMES = {"reverse_words"}
+
+
+def misspell(rng: random.Random, name: str) -> str:
+    """(name) with a character dropped, doubled, swapped with the next, or
+    replaced."""
+    i = rng.randrange(len(name))
+    edit = rng.randrange(4)
+    if edit == 0 and len(name) > 1:
+        return name[:i] + name[i + 1 :]
+    if edit == 1:
+        return name[:i] + name[i] + name[i:]
+    if edit == 2 and i + 1 < len(name):
+        return name[:i] + name[i + 1] + name[i] + name[i + 2 :]
+    return name[:i] + rng.choice("aeiou_.") + name[i + 1 :]
+
+
+def check(label: str, words, ours, difflibs) -> bool:
+    mismatches = 0
+    for word in words:
+        expected = difflibs(word)
+        if ours(word) != expected:
+            mismatches += 1
+            print(f"FAIL suggestions for {label} {word!r}: {ours(word)} != {expected}")
+    if not mismatches:
+        print(f"OK suggestions for {len(words)} misspelled {label}")
+    return not mismatches
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--seed", type=int, default=0, help="misspelling random seed")
+    parser.add_argument(
+        "--names", type=int, default=300, help="known names to misspell per kind"
+    )
+    args = parser.parse_args(argv)
+    rng = random.Random(args.seed)
+    jinjalint.init_catalog()
+    ok = True
+    for kind in ("filter", "test"):
+        jinjalint.resolve_all_namespaces(kind)
+        known = sorted(jinjalint.KNOWN_NAMES[kind])
+        sample = rng.sample(known, min(args.names, len(known)))
+        words = [misspell(rng, name) for name in sample]
+        words = [word for word in words if word not in jinjalint.KNOWN_NAMES[kind]]
+        ok &= check(
+            kind + "s",
+            words,
+            lambda word: jinjalint.suggest(word, kind),
+            lambda word: difflib.get_close_matches(word, known, 2, 0.1),
+        )
+    ok &= check(
+        "local filters",
+        [misspell(rng, name) for name in sorted(LOCAL_NAMES) * 10],
+        lambda word: jinjalint.suggest(word, "filter", LOCAL_NAMES),
+        lambda word: difflib.get_close_matches(
+            word, jinjalint.KNOWN_NAMES["filter"] | LOCAL_NAMES, 2, 0.1
+        ),
+    )
+    distributions = list(jinjalint.DISTRIBUTIONS.names)
+    words = [name.lower() for name in distributions]
+    words += [misspell(rng, name) for name in distributions * 3]
+    ok &= check(
+        "distributions",
+        [word for word in words if word not in distributions],
+        lambda word: [
+            name for _, name in jinjalint.DISTRIBUTIONS.close_matches(word, 3, 0.25)
+        ],
+        lambda word: difflib.get_close_matches(word, distributions, 3, 0.25),
+    )
+    return int(not ok)
+
+
+if "__main__" == __name__:
+    sys.exit(main())
@@ -0,0 +1,11 @@
+# Found by jinjalint.py next to local-filter.yml, like ansible finds the
+# filter_plugins/ directory next to a playbook or in a role.
+
+
+def reverse_words(value):
+    return " ".join(reversed(value.split()))
+
+
+class FilterModule:
+    def filters(self):
+        return {"reverse_words": reverse_words}